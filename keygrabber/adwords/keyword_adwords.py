@@ -1,5 +1,6 @@
 import os
 import sys
+import threading
 sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), 'adwords_api_python_14.2.1' ))
 from adspygoogle.adwords.AdWordsClient import AdWordsClient
 from adspygoogle.common import Utils
@@ -12,15 +13,20 @@ campaign_service = client.GetCampaignService(
 targeting_idea_service = client.GetTargetingIdeaService('https://adwords.google.com', 'v201101')
 traffic_estimator_service = client.GetTrafficEstimatorService('https://adwords.google.com', 'v201101')
 
+#keywords sent in a single STATS request by get_keywords_info
+BATCH_SIZE = 100
 
-def get_keyword_info(keyword, mode='BROAD'):
-	selector = {
+#services of the threads calling get_keywords_info
+local = threading.local()
+
+def _stats_selector(keywords, mode, attributes, results):
+	return {
 		'searchParameters': [{
 			'type': 'RelatedToKeywordSearchParameter',
 			'keywords': [{
 				'text': keyword,
 				'matchType': mode
-			}]
+			} for keyword in keywords]
 		},{
 		   'type': 'KeywordMatchTypeSearchParameter',
 		   'keywordMatchTypes': [mode]
@@ -33,12 +39,52 @@ def get_keyword_info(keyword, mode='BROAD'):
 		}],
 		'ideaType': 'KEYWORD',
 		'requestType': 'STATS',
-		'requestedAttributeTypes': ['GLOBAL_MONTHLY_SEARCHES', 'AVERAGE_TARGETED_MONTHLY_SEARCHES'],
+		'requestedAttributeTypes': attributes,
 		'paging': {
 			'startIndex': '0',
-			'numberResults': '1000'
+			'numberResults': str(results)
 		}
 	}
+
+def _searches(data):
+	'''
+	(global_searches, regional_searches) of the data of an idea
+	'''
+	global_searches = None
+	regional_searches = None
+	if 'value' in data['GLOBAL_MONTHLY_SEARCHES']:
+		global_searches = int(data['GLOBAL_MONTHLY_SEARCHES']['value'])
+	if 'value' in data['AVERAGE_TARGETED_MONTHLY_SEARCHES']:
+		regional_searches = int(data['AVERAGE_TARGETED_MONTHLY_SEARCHES']['value'])
+	return global_searches, regional_searches
+
+def get_keywords_info(keywords, mode='BROAD'):
+	'''
+	get_keyword_info of many keywords with a single STATS request, the
+	KEYWORD attribute tells which keyword an idea is about. Can be called
+	from many threads, each one uses its own service.
+	Returns {keyword: dict(global_searches, regional_searches)}
+	'''
+	service = getattr(local, 'service', None)
+	if service is None:
+		service = local.service = client.GetTargetingIdeaService('https://adwords.google.com', 'v201101')
+	selector = _stats_selector(keywords, mode, ['KEYWORD', 'GLOBAL_MONTHLY_SEARCHES', 'AVERAGE_TARGETED_MONTHLY_SEARCHES'], len(keywords))
+	ret = service.Get(selector)[0]
+	#ideas come back with the text of the keyword, normalized
+	by_text = dict()
+	if ret is not None and 'entries' in ret and ret['entries']:
+		for key in ret['entries']:
+			data = Utils.GetDictFromMap(key['data'])
+			by_text[data['KEYWORD']['value']['text'].strip().lower()] = _searches(data)
+	info = dict()
+	for keyword in keywords:
+		global_searches, regional_searches = by_text.get(keyword.strip().lower(), (None, None))
+		info[keyword] = dict(global_searches = global_searches, regional_searches = regional_searches)
+	return info
+
+
+def get_keyword_info(keyword, mode='BROAD'):
+	selector = _stats_selector([keyword], mode, ['GLOBAL_MONTHLY_SEARCHES', 'AVERAGE_TARGETED_MONTHLY_SEARCHES'], 1000)
 	
 	selector_estimator_service = {
 		'campaignEstimateRequests': [{
@@ -82,10 +128,9 @@ def get_keyword_info(keyword, mode='BROAD'):
 	if ret is not None and 'entries' in ret and ret['entries']:
 	  for key in ret['entries']:
 			data = Utils.GetDictFromMap(key['data'])
-			if 'value' in data['GLOBAL_MONTHLY_SEARCHES']:
-				global_searches = int(data['GLOBAL_MONTHLY_SEARCHES']['value'])
-			if 'value' in data['AVERAGE_TARGETED_MONTHLY_SEARCHES']:
-				regional_searches = int(data['AVERAGE_TARGETED_MONTHLY_SEARCHES']['value'])
+			searches = _searches(data)
+			global_searches = searches[0] if searches[0] is not None else global_searches
+			regional_searches = searches[1] if searches[1] is not None else regional_searches
 	
 	if estimates is not None:
 	  ad_group_estimate = estimates['campaignEstimates'][0]['adGroupEstimates'][0]
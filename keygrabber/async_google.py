@@ -0,0 +1,162 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+'''
+Concurrent Google Instant client.
+
+The crawler still consumes the answers one after another, in the very same
+order, so the documents it writes do not change. What changes is that the
+requests it announces with prefetch() are already in flight, at most
+`concurrency` of them at once and no more than `rate` per second.
+'''
+import unittest
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+from google import Google, max_answers
+
+log = logging.getLogger('google')
+
+class AsyncGoogle(Google):
+	def __init__(self, proxy=None, concurrency=8, rate=None, max_pending=1000, cache=None, throttle=None, proxies=None, url=None, recorder=None):
+		Google.__init__(self, proxy, cache, throttle, proxies, url=url, recorder=recorder)
+		self.concurrency = concurrency
+		self.lookahead = concurrency
+		self.rate = rate
+		self.max_pending = max_pending
+		self.pending = OrderedDict()
+		self.executor = ThreadPoolExecutor(max_workers=concurrency)
+		self.loop = asyncio.new_event_loop()
+		self.semaphore = asyncio.Semaphore(concurrency)
+		self._next_slot = 0
+		self.thread = threading.Thread(target=self.loop.run_forever, name='async-google')
+		self.thread.daemon = True
+		self.thread.start()
+
+	def _get_blocking(self, keyword):
+		return Google.getInstantKeys(self, keyword)
+
+	async def _throttle(self):
+		if not self.rate:
+			return
+		now = self.loop.time()
+		slot = max(now, self._next_slot)
+		self._next_slot = slot + 1.0 / self.rate
+		if slot > now:
+			await asyncio.sleep(slot - now)
+
+	async def _fetch(self, keyword):
+		async with self.semaphore:
+			await self._throttle()
+			return await self.loop.run_in_executor(self.executor, self._get_blocking, keyword)
+
+	def _schedule(self, keyword):
+		return asyncio.run_coroutine_threadsafe(self._fetch(keyword), self.loop)
+
+	def prefetch(self, *keywords):
+		'''
+		Start fetching keywords in background. The oldest requests which
+		have not been consumed yet are forgotten after max_pending
+		'''
+		for keyword in keywords:
+			if keyword in self.pending:
+				self.pending.move_to_end(keyword)
+				continue
+			self.pending[keyword] = self._schedule(keyword)
+		while len(self.pending) > self.max_pending:
+			keyword, future = self.pending.popitem(last=False)
+			future.cancel()
+
+	def cancel(self, prefix):
+		'''
+		Forget the prefetched keywords starting with prefix. The requests
+		still waiting for a slot are never sent
+		'''
+		for keyword in [keyword for keyword in self.pending if keyword.startswith(prefix)]:
+			self.pending.pop(keyword).cancel()
+
+	def getInstantKeys(self, keyword, *args, **kwargs):
+		future = self.pending.pop(keyword, None)
+		if future is None or future.cancelled():
+			future = self._schedule(keyword)
+		return future.result()
+
+	def close(self):
+		for future in self.pending.values():
+			future.cancel()
+		self.pending.clear()
+		self.loop.call_soon_threadsafe(self.loop.stop)
+		self.thread.join()
+		self.executor.shutdown(wait=False)
+
+class AsyncGoogleTest(unittest.TestCase):
+
+	class FakeGoogle(AsyncGoogle):
+		def __init__(self, *args, **kwargs):
+			AsyncGoogle.__init__(self, *args, **kwargs)
+			self.lock = threading.Lock()
+			self.running = 0
+			self.peak = 0
+			self.requests = list()
+
+		def _get_blocking(self, keyword):
+			with self.lock:
+				self.running += 1
+				self.peak = max(self.peak, self.running)
+				self.requests.append(keyword)
+			time.sleep(0.01)
+			with self.lock:
+				self.running -= 1
+			if len(keyword.split()) > 2:
+				return []
+			return [keyword.strip()+' '+letter for letter in 'abcdefghij'[:max_answers]]
+
+	def test_same_expansion(self):
+		g = self.FakeGoogle(concurrency=4)
+		expanded = list(g.expand('come'))
+		self.assertTrue(1 < g.peak <= 4)
+		reference = self.FakeGoogle(concurrency=1)
+		self.assertEqual(expanded, list(Google.expand(reference, 'come')))
+		g.close()
+		reference.close()
+
+	def test_breadth_first(self):
+		g = self.FakeGoogle(concurrency=8)
+		depth_first = list(g.expand('come'))
+		breadth_first = list(g.expand('come', breadth_first=True))
+		self.assertEqual(sorted(depth_first), sorted(breadth_first))
+		self.assertEqual([level for k, level in breadth_first], sorted(level for k, level in breadth_first))
+		g.close()
+
+	def test_wide_level(self):
+		#the second level has 10 siblings
+		g = self.FakeGoogle(concurrency=4, max_pending=4)
+		expanded = list(g.expand('come', breadth_first=True))
+		self.assertEqual(len(expanded), 110)
+		self.assertEqual(len(g.requests), len(set(g.requests)))
+		g.close()
+
+	def test_cancel(self):
+		g = self.FakeGoogle(concurrency=1)
+		g.prefetch('come a', 'come aa', 'come ab', 'come b')
+		g.cancel('come a')
+		self.assertEqual(list(g.pending), ['come b'])
+		g.search('come b')
+		#come a may have been running already
+		self.assertEqual([k for k in g.requests if k not in ('come a', 'come b')], [])
+		g.close()
+
+	def test_rate(self):
+		g = self.FakeGoogle(concurrency=4, rate=50)
+		start = time.time()
+		g.prefetch(*['come %s' % i for i in range(10)])
+		for i in range(10):
+			g.search('come %s' % i)
+		self.assertTrue(time.time() - start >= 9 / 50.0)
+		g.close()
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+'''
+End to end benchmark of not_so_simple_search against a ReplayServer
+
+usage: bench_crawl.py [options]
+  --base=come          base keyword of the crawl
+  --recording=path     jsonl of recorded answers (see replay.Recorder)
+  --size=5000          keywords of the synthetic google answering the
+                       terms missing from the recording
+  --seed=0             seed of the synthetic google
+  --latency=0.0        seconds every answer takes, --jitter=0.0 more at most
+  --concurrency=1      in flight requests (AsyncGoogle when > 1)
+  --breadth-first      expand one level at a time
+  --db=keygrabber_bench  mongo database the crawl is written to
+  --save=path          write the crawled keywords to path
+  --compare=path       compare the crawled keywords with a saved run
+'''
+import sys
+import time
+import getopt
+import hashlib
+import logging
+
+from google import Google
+from async_google import AsyncGoogle
+from throttle import Throttle
+from keyword_manager import KeywordManager
+from dictionary_generator import SmartDict
+from replay import ReplayServer, SyntheticSuggest, load_recording
+from log_setup import setup_logging
+
+def main(argv=None):
+	if argv is None:
+		argv = sys.argv
+	opts, extraparams = getopt.gnu_getopt(argv[1:], "h", ['help', 'base=', 'recording=', 'size=', 'seed=', 'latency=', 'jitter=', 'concurrency=', 'breadth-first', 'db=', 'save=', 'compare='])
+	base = 'come'
+	recording = None
+	size = 5000
+	seed = 0
+	latency = 0.0
+	jitter = 0.0
+	concurrency = 1
+	breadth_first = False
+	db_name = 'keygrabber_bench'
+	save = None
+	compare = None
+	for o, a in opts:
+		if o in ("-h", "--help"):
+			print(__doc__)
+			return 0
+		elif o == '--base':
+			base = a
+		elif o == '--recording':
+			recording = a
+		elif o == '--size':
+			size = int(a)
+		elif o == '--seed':
+			seed = int(a)
+		elif o == '--latency':
+			latency = float(a)
+		elif o == '--jitter':
+			jitter = float(a)
+		elif o == '--concurrency':
+			concurrency = int(a)
+		elif o == '--breadth-first':
+			breadth_first = True
+		elif o == '--db':
+			db_name = a
+		elif o == '--save':
+			save = a
+		elif o == '--compare':
+			compare = a
+
+	setup_logging(logging.WARNING, path=None, google_path=None)
+	server = ReplayServer(load_recording(recording) if recording else None, SyntheticSuggest(base, size, seed), latency, jitter).start()
+	#the replay server is the bottleneck we want, not the throttle
+	throttle = Throttle(rate=10000, max_rate=10000, burst=1000, report_every=0)
+	if concurrency > 1:
+		google = AsyncGoogle(concurrency=concurrency, throttle=throttle, url=server.url)
+	else:
+		google = Google(throttle=throttle, url=server.url)
+	km = KeywordManager(SmartDict(size=4), google, breadth_first=breadth_first, db_name=db_name)
+
+	start = time.time()
+	km.not_so_simple_search(base=base)
+	elapsed = time.time() - start
+	server.stop()
+
+	keywords = sorted(doc['keyword'] for doc in km.collection.find({}, ['keyword']))
+	stats = km.publish_stats()
+	print('crawl of %r: %.2fs, %s requests (%.1f/s), %s keywords (%.1f/s)' % (base, elapsed, server.requests, server.requests / elapsed, len(keywords), len(keywords) / elapsed))
+	for phase, timing in sorted(stats['phases'].items(), key=lambda item: -item[1]['seconds']):
+		print('  %-10s %8.2fs %8s calls %5.1f%%' % (phase, timing['seconds'], timing['calls'], 100 * timing['share']))
+	print('keywords digest: %s' % hashlib.sha1('\n'.join(keywords).encode('utf-8')).hexdigest())
+	if save:
+		with open(save, 'w', encoding='utf-8') as f:
+			f.write('\n'.join(keywords) + '\n')
+	if compare:
+		with open(compare, encoding='utf-8') as f:
+			expected = set(line.rstrip('\n') for line in f if line.strip())
+		found = set(keywords)
+		print('compared with %s: %s missing, %s more' % (compare, len(expected - found), len(found - expected)))
+		return 0 if expected == found else 1
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+'''
+Benchmark of the ordering strategies on synthetic crawls stored in mongo
+
+usage: bench_ordering.py [options]
+  --sizes=10000,100000,1000000  keywords of the synthetic crawls
+  --strategies=name,...  strategies to run at every size, by default all of
+                         ordering_strategies.STRATEGIES, up to their MAX_SIZE
+  --seed=0               seed of the synthetic crawls
+  --run-size=100000      keywords in memory of the strategies sorting on disk
+  --db=keygrabber_bench  mongo database whose crawler collection holds the crawls
+
+Every strategy reports its time, its peak of python memory (tracemalloc,
+which slows it down too) and the operations the mongo server counted
+while it ran (serverStatus opcounters: queries, getmores, commands and
+writes). The server should serve nobody else during the benchmark.
+'''
+import sys
+import time
+import getopt
+import tracemalloc
+
+import pymongo
+
+from ordering_strategies import STRATEGIES, ON_DISK, MAX_SIZE, order, synthetic_crawl
+
+def load(db, size, seed):
+	'''
+	The crawler collection of db holding the synthetic crawl
+	'''
+	collection = db.crawler
+	collection.drop()
+	batch = list()
+	for doc in synthetic_crawl(size, seed=seed):
+		batch.append(doc)
+		if len(batch) >= 1000:
+			collection.insert(batch)
+			batch = list()
+	if batch:
+		collection.insert(batch)
+	return collection
+
+def mongo_ops(db):
+	counters = db.command('serverStatus')['opcounters']
+	#some servers add a document of deprecated counters
+	return sum(value for value in counters.values() if isinstance(value, (int, float)))
+
+def run(name, collection, run_size):
+	'''
+	Returns (seconds, keywords, peak bytes, mongo operations) of ordering
+	collection with name
+	'''
+	options = dict(run_size=run_size) if name in ON_DISK else dict()
+	ops = mongo_ops(collection.database)
+	tracemalloc.start()
+	start = time.time()
+	try:
+		count = 0
+		for doc in order(name, collection, **options):
+			count = count + 1
+		seconds = time.time() - start
+		peak = tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+	#the serverStatus of the second reading counts itself
+	return seconds, count, peak, mongo_ops(collection.database) - ops - 1
+
+def main(argv=None):
+	if argv is None:
+		argv = sys.argv
+	opts, extraparams = getopt.gnu_getopt(argv[1:], "h", ['help', 'sizes=', 'strategies=', 'seed=', 'run-size=', 'db='])
+	sizes = [10000, 100000, 1000000]
+	names = sorted(STRATEGIES)
+	capped = True
+	seed = 0
+	run_size = 100000
+	db_name = 'keygrabber_bench'
+	for o, a in opts:
+		if o in ("-h", "--help"):
+			print(__doc__)
+			return 0
+		elif o == '--sizes':
+			sizes = [int(size) for size in a.split(',')]
+		elif o == '--strategies':
+			names = a.split(',')
+			capped = False
+		elif o == '--seed':
+			seed = int(a)
+		elif o == '--run-size':
+			run_size = int(a)
+		elif o == '--db':
+			db_name = a
+
+	db = pymongo.Connection()[db_name]
+	print('%-16s %9s %9s %9s %10s %8s' % ('strategy', 'size', 'seconds', 'keywords', 'peak MB', 'mongo ops'))
+	for size in sizes:
+		collection = load(db, size, seed)
+		for name in names:
+			if capped and size > MAX_SIZE.get(name, size):
+				print('%-16s %9s %9s' % (name, size, 'skipped'))
+				continue
+			seconds, count, peak, ops = run(name, collection, run_size)
+			print('%-16s %9s %9.2f %9s %10.1f %8s' % (name, size, seconds, count, peak / 1024.0 / 1024.0, ops))
+			sys.stdout.flush()
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,43 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+'''
+Microbenchmark of the Google Instant answer parser over recorded answers
+
+usage: bench_suggest_parser.py [recording.jsonl] [rounds]
+'''
+import sys
+import re
+import json
+import timeit
+from html import unescape
+
+from suggest_parser import parse_suggest, load_samples, SAMPLES
+
+def legacy_parse(data):
+	'''
+	The parser Google.getInstantKeys used before suggest_parser
+	'''
+	HTMLtag = re.compile(r'<\/*b>')
+	data = data.decode('iso-8859-15')
+	if data[0:18] != 'window.google.ac.h':
+		return None
+	try:
+		g_list = json.loads(data[19:-1])
+	except:
+		return []
+	return [unescape(HTMLtag.sub('', entry[0])) for entry in g_list[1]]
+
+def main(argv=None):
+	if argv is None:
+		argv = sys.argv
+	path = argv[1] if len(argv) > 1 else SAMPLES
+	rounds = int(argv[2]) if len(argv) > 2 else 2000
+	samples = [data for term, data in load_samples(path)]
+	print('%s answers, %s rounds' % (len(samples), rounds))
+	for name, parse in (('legacy', legacy_parse), ('parse_suggest', parse_suggest)):
+		elapsed = min(timeit.repeat(lambda: [parse(data) for data in samples], number=rounds, repeat=3))
+		print('%-14s %8.2f us/answer' % (name, elapsed * 1e6 / (rounds * len(samples))))
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
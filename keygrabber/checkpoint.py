@@ -0,0 +1,49 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+'''
+Mongo checkpoints of a running crawl, used by keygrabber --resume
+'''
+import pymongo
+from frontier import Frontier
+
+class Checkpoint(object):
+	'''
+	The crawl position is a single document in crawler_checkpoint, the
+	frontier journal is appended to crawler_frontier. Journal entries are
+	tagged with the checkpoint sequence number, so anything written after
+	the last complete checkpoint is discarded on load.
+	'''
+	def __init__(self, db, name='crawler'):
+		self.name = name
+		self.state = db.crawler_checkpoint
+		self.items = db.crawler_frontier
+		self.items.ensure_index([('checkpoint', pymongo.ASCENDING), ('seq', pymongo.ASCENDING), ('n', pymongo.ASCENDING)])
+		self.seq = 0
+
+	def clear(self):
+		self.state.remove({'_id': self.name})
+		self.items.remove({'checkpoint': self.name})
+		self.seq = 0
+
+	def save(self, frontier, **state):
+		self.seq = self.seq + 1
+		journal = frontier.flush_journal()
+		if journal:
+			self.items.insert([dict(checkpoint=self.name, seq=self.seq, n=n, kind=kind, value=value) for n, (kind, value) in enumerate(journal)])
+		state['_id'] = self.name
+		state['seq'] = self.seq
+		self.state.save(state)
+
+	def load(self, factory):
+		'''
+		Returns (state, frontier) of the last checkpoint or (None, None)
+		'''
+		state = self.state.find_one({'_id': self.name})
+		if state is None:
+			return None, None
+		self.seq = state['seq']
+		self.items.remove({'checkpoint': self.name, 'seq': {'$gt': self.seq}})
+		frontier = Frontier()
+		for item in self.items.find({'checkpoint': self.name}).sort([('seq', pymongo.ASCENDING), ('n', pymongo.ASCENDING)]):
+			frontier.replay(item['kind'], item['value'], factory)
+		return state, frontier
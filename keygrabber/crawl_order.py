@@ -0,0 +1,192 @@
+# -*- coding: UTF-8 -*-
+'''
+Crawl order of the keywords of the crawler collection
+'''
+import unittest
+import re
+import random
+from string import ascii_lowercase
+from external_sort import external_sort, mongo_key
+
+ASCENDING = 1
+DESCENDING = -1
+
+#the fields of the threshold walk of the old fast_order, in its order
+GROUP = ['dicts', 'level', 'depth', 'dbplace']
+ORDER = [(field, ASCENDING) for field in GROUP] + [('_id', ASCENDING)]
+#read by order_key
+KEY_FIELDS = GROUP + ['keyword', '_id']
+#the sort of ordering.fast_order
+FAST_ORDER = GROUP + ['keyword']
+fast_order_key = mongo_key(FAST_ORDER)
+
+def ordered_keywords(collection, batch_size=1000):
+	'''
+	Yields the keywords of a crawl by dicts, level, depth and dbplace, then
+	by the letter following the root and in insertion order, as the walk
+	over every (dicts, level, depth, dbplace, letter) threshold did. A
+	single cursor goes along the ORDER index: only the keywords of one
+	(dicts, level, depth, dbplace) group are in memory at a time. Like the
+	walk, it leaves out the root and the keywords of the last dictionary.
+	'''
+	crawl = crawl_spec(collection)
+	if crawl is None:
+		return
+	spec, prefix, max_dicts = crawl
+	cursor = collection.find(spec).sort(ORDER).batch_size(batch_size)
+	for doc in by_letter(cursor, len(prefix)):
+		yield doc
+
+def fast_ordered_keywords(collection, batch_size=1000):
+	'''
+	Cursor over every keyword of the crawler collection by FAST_ORDER, the
+	order of ordering.fast_order, sorted by mongo along its index
+	'''
+	collection.ensure_index([(field, ASCENDING) for field in FAST_ORDER])
+	return collection.find().sort([(field, ASCENDING) for field in FAST_ORDER]).batch_size(batch_size)
+
+def external_ordered_keywords(collection, run_size=100000, tmpdir=None, batch_size=1000):
+	'''
+	The keywords of fast_ordered_keywords without the mongo sort and its
+	index: collection is read in natural order and sorted on disk with at
+	most run_size keywords in memory, see external_sort
+	'''
+	return external_sort(collection.find().batch_size(batch_size), fast_order_key, run_size, tmpdir=tmpdir)
+
+def crawl_spec(collection):
+	'''
+	Returns (spec, prefix, max_dicts): the query of the keywords
+	ordered_keywords yields, the root keyword followed by a space and the
+	last dictionary of the crawl. None if there is no crawl.
+	'''
+	root = collection.find_one(dict(dicts=0, parent=None))
+	last = list(collection.find({}, ['dicts']).sort([('dicts', DESCENDING)]).limit(1))
+	if root is None or not last:
+		return None
+	max_dicts = last[0].get('dicts')
+	prefix = root.get('keyword') + ' '
+	if max_dicts > 1:
+		spec = {'dicts': {'$gte': 1, '$lt': max_dicts}}
+	else:
+		#the walk stopped at its first threshold
+		spec = dict(dicts=1, level=0, depth=0, dbplace=1)
+	spec['keyword'] = re.compile('^' + re.escape(prefix) + '[a-z]')
+	return spec, prefix, max_dicts
+
+def order_key(doc, offset):
+	'''
+	Sort key of doc in the order of ordered_keywords, offset being the
+	length of the prefix
+	'''
+	return tuple(doc.get(field) for field in GROUP) + (doc['keyword'][offset], doc['_id'])
+
+def by_letter(docs, offset):
+	'''
+	docs come sorted by ORDER, every GROUP is yielded letter by letter,
+	the letter being the character at offset of the keyword
+	'''
+	group = None
+	letters = dict()
+	for doc in docs:
+		key = tuple(doc.get(field) for field in GROUP)
+		if key != group:
+			for item in _in_letter_order(letters):
+				yield item
+			group = key
+			letters = dict()
+		letters.setdefault(doc['keyword'][offset], []).append(doc)
+	for item in _in_letter_order(letters):
+		yield item
+
+def _in_letter_order(letters):
+	for letter in ascii_lowercase:
+		for doc in letters.get(letter, ()):
+			yield doc
+
+class OrderedKeywordsTest(unittest.TestCase):
+
+	class Cursor(object):
+		def __init__(self, docs):
+			self.docs = docs
+		def sort(self, order):
+			for field, direction in reversed(order):
+				#None first, as mongo does
+				self.docs.sort(key=lambda doc: (doc.get(field) is not None, doc.get(field)), reverse=direction == DESCENDING)
+			return self
+		def limit(self, n):
+			self.docs = self.docs[:n]
+			return self
+		def batch_size(self, n):
+			return self
+		def __iter__(self):
+			return iter(self.docs)
+
+	class Collection(object):
+		def __init__(self, docs):
+			self.docs = docs
+		def match(self, doc, spec):
+			for field, value in spec.items():
+				if hasattr(value, 'match'):
+					if not value.match(doc.get(field)):
+						return False
+				elif isinstance(value, dict):
+					if not (value['$gte'] <= doc.get(field) < value['$lt']):
+						return False
+				elif doc.get(field) != value:
+					return False
+			return True
+		def find(self, spec=None, fields=None):
+			return OrderedKeywordsTest.Cursor([doc for doc in self.docs if self.match(doc, spec or {})])
+		def find_one(self, spec):
+			for doc in self.find(spec):
+				return doc
+
+	def threshold_walk(self, collection):
+		'''
+		the fast_order of KeywordManager this module replaces
+		'''
+		def _update_threshold(dicts= 100, level = 7, depth =4, dbplace=10):
+			m_dicts, m_level, m_depth, m_dbplace = 1, 0, 0, 1
+			yield (m_dicts, m_level, m_depth, m_dbplace)
+			while m_dicts < dicts:
+				m_dbplace = m_dbplace + 1
+				if m_dbplace > dbplace:
+					m_depth = m_depth +1
+					m_dbplace = 1
+				if m_depth > depth:
+					m_level = m_level + 1
+					m_depth = 0
+					m_dbplace = 0
+				if m_level > level:
+					m_dicts = m_dicts +1
+					m_level = 0
+					m_depth = 0
+					m_dbplace = 0
+				yield (m_dicts, m_level, m_depth, m_dbplace)
+		inst_list = list()
+		root = collection.find_one(dict(dicts=0, parent=None))
+		maxima = [collection.find().sort([(field, DESCENDING)]).docs[0].get(field) for field in GROUP]
+		for (dicts, level, depth, dbplace) in _update_threshold(*maxima):
+			for letter in ascii_lowercase:
+				inst_list.extend(collection.find(dict(keyword=re.compile('^'+root.get('keyword')+' '+letter), dicts=dicts, level=level, depth=depth, dbplace=dbplace)))
+		return inst_list
+
+	def crawl(self, dicts, seed):
+		rnd = random.Random(seed)
+		docs = [dict(_id=0, keyword='come', dicts=0, level=0, depth=0, parent=None)]
+		for i in range(1, 200):
+			keyword = 'come ' + rnd.choice(ascii_lowercase + '1') + rnd.choice(['are', 'sta', ' fare', ''])
+			docs.append(dict(_id=i, keyword=keyword, parent='come', dicts=rnd.randint(1, dicts), level=rnd.randint(0, 1), depth=rnd.randint(0, 2), dbplace=rnd.randint(1, 3)))
+		return self.Collection(docs)
+
+	def test_same_order(self):
+		for dicts, seed in ((4, 0), (2, 1), (1, 2)):
+			collection = self.crawl(dicts, seed)
+			expected = [doc['_id'] for doc in self.threshold_walk(collection)]
+			self.assertTrue(len(expected) > 0)
+			self.assertEqual([doc['_id'] for doc in ordered_keywords(collection)], expected)
+			prefix = crawl_spec(collection)[1]
+			self.assertEqual([doc['_id'] for doc in sorted(self.threshold_walk(collection), key=lambda doc: order_key(doc, len(prefix)))], expected)
+
+if __name__ == '__main__':
+	unittest.main()
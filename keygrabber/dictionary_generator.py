@@ -11,29 +11,76 @@ import itertools
 import string
 
 class SmartDict(object):
+    '''
+    Yields '', then every word of seq letters of length 1, 2, ... size, in
+    lexicographic order. jump() bans the current word: no word starting
+    with it is yielded anymore. Words are enumerated depth first one
+    length at a time, so a banned prefix costs one set lookup and its whole
+    subtree is skipped without being generated.
+    '''
     def __init__(self, **kwargs):
         self.seq = kwargs.get('seq', string.ascii_lowercase)
         self.size = kwargs.get('size', 3)
         self.blacklist = kwargs.get('blacklist', [])
+        self.banned = set(self.blacklist)
         self.actual = None
     
     def __iter__(self):
         return self
 
     def get(self, **kwargs):
-        seq = kwargs.get('seq', self.seq)
-        size = kwargs.get('size', self.size)
-        blacklist = kwargs.get('blacklist', self.blacklist)
-        self.actual = ''
-        yield ''
-        for p in itertools.chain.from_iterable(map(lambda x: itertools.product(seq, repeat=x), range(1,size+1))):
-            joined = ''.join(p)
-            if not any(joined.startswith(prefix) for prefix in blacklist):
-                self.actual = joined
-                yield joined
+        self.seq = kwargs.get('seq', self.seq)
+        self.size = kwargs.get('size', self.size)
+        if 'blacklist' in kwargs:
+            self.blacklist = kwargs['blacklist']
+            self.banned = set(self.blacklist)
+        #resume the iteration after the given word
+        after = kwargs.get('after')
+        self.actual = '' if after is None else after
+        for word in self._walk(after):
+            self.actual = word
+            yield word
 
     def jump(self):
         self.blacklist.append(self.actual)
+        self.banned.add(self.actual)
+
+    def peek(self, n):
+        '''
+        Returns the next n words get() is going to yield if no jump() happens
+        '''
+        return list(itertools.islice(self._walk(self.actual), n))
+
+    def _walk(self, after=None):
+        '''
+        Words in the get() order coming after the word after, or all of them
+        '''
+        if after is None:
+            yield ''
+        if '' in self.banned:
+            return
+        first = len(after) if after else 1
+        for length in range(first, self.size + 1):
+            for word in self._words('', length, after if after and length == len(after) else None):
+                yield word
+
+    def _words(self, prefix, length, start):
+        '''
+        Words of the given length extending prefix, skipping banned subtrees.
+        start is a word on the path of prefix: the walk begins right after it
+        '''
+        first = self.seq.index(start[len(prefix)]) if start is not None else 0
+        for i in range(first, len(self.seq)):
+            word = prefix + self.seq[i]
+            if word in self.banned:
+                continue
+            on_start = start is not None and i == first
+            if len(word) == length:
+                if not on_start:
+                    yield word
+            else:
+                for w in self._words(word, length, start if on_start else None):
+                    yield w
         
 class SmartDictTest(unittest.TestCase):
     
@@ -47,6 +94,49 @@ class SmartDictTest(unittest.TestCase):
 				result.append(p)
         #maybe fake, do not trust:
 		self.assertTrue(any(x.startswith(y) for x in result for y in banned), False)
-       
+
+	def test_peek(self):
+		c = SmartDict(seq='abc', size=2)
+		seen = []
+		for p in c.get():
+			if p == '':
+				self.assertEqual(c.peek(4), ['a', 'b', 'c', 'aa'])
+			if p == 'b':
+				self.assertEqual(c.peek(4), ['c', 'ba', 'bb', 'bc'])
+			if p == 'a':
+				c.jump()
+				self.assertEqual(c.peek(3), ['b', 'c', 'ba'])
+			seen.append(p)
+		self.assertEqual(seen, ['', 'a', 'b', 'c', 'ba', 'bb', 'bc', 'ca', 'cb', 'cc'])
+		self.assertEqual(c.peek(3), [])
+
+	def test_resume(self):
+		c = SmartDict(seq='abc', size=2, blacklist=['a'])
+		self.assertEqual(list(c.get(after='bb')), ['bc', 'ca', 'cb', 'cc'])
+		self.assertEqual(list(c.get(after=''))[:2], ['b', 'c'])
+
+	def test_same_order(self):
+		'''
+		compare with the plain generate and filter enumeration
+		'''
+		c = SmartDict(seq='abcd', size=3)
+		banned = []
+		result = []
+		for p in c.get():
+			result.append(p)
+			if p in ('b', 'ca', 'dd', 'aab', 'cbc'):
+				banned.append(p)
+				c.jump()
+		expected = ['']
+		blacklist = []
+		for p in itertools.chain.from_iterable(itertools.product('abcd', repeat=x) for x in range(1, 4)):
+			joined = ''.join(p)
+			if not any(joined.startswith(prefix) for prefix in blacklist):
+				expected.append(joined)
+				if joined in banned:
+					blacklist.append(joined)
+		self.assertEqual(result, expected)
+		self.assertEqual(c.blacklist, banned)
+
 if __name__ == '__main__':
     sys.exit(unittest.main())
@@ -0,0 +1,97 @@
+# -*- coding: UTF-8 -*-
+'''
+Sorting of streams larger than memory through sorted runs on disk
+'''
+import unittest
+import heapq
+import pickle
+import random
+import tempfile
+import itertools
+
+def mongo_key(fields):
+	'''
+	Key of the documents by fields with None first, as mongo sorts them
+	'''
+	def key(doc):
+		return tuple((doc.get(field) is not None, doc.get(field)) for field in fields)
+	return key
+
+def external_sort(items, key, run_size=100000, fan_in=64, tmpdir=None):
+	'''
+	Yields items, any iterable, sorted by key and stable. At most run_size
+	items are in memory: every run_size items are sorted and written to
+	a temporary file, the runs are then merged fan_in at a time.
+	'''
+	items = iter(items)
+	first = sorted(itertools.islice(items, run_size), key=key)
+	if len(first) < run_size:
+		#it fits in memory
+		for item in first:
+			yield item
+		return
+	runs = [_write_run(first, tmpdir)]
+	del first
+	while True:
+		run = sorted(itertools.islice(items, run_size), key=key)
+		if not run:
+			break
+		runs.append(_write_run(run, tmpdir))
+	while len(runs) > fan_in:
+		runs = [_write_run(_merge(runs[i:i + fan_in], key), tmpdir) for i in range(0, len(runs), fan_in)]
+	for item in _merge(runs, key):
+		yield item
+
+def _write_run(items, tmpdir):
+	f = tempfile.TemporaryFile(dir=tmpdir)
+	for item in items:
+		pickle.dump(item, f, pickle.HIGHEST_PROTOCOL)
+	f.seek(0)
+	return f
+
+def _read_run(f, n, key):
+	'''
+	(key, run, position, item) of the items of a run: the ties go to the
+	earlier run, the items themselves are never compared
+	'''
+	try:
+		for position in itertools.count():
+			try:
+				item = pickle.load(f)
+			except EOFError:
+				return
+			yield key(item), n, position, item
+	finally:
+		f.close()
+
+def _merge(runs, key):
+	for decorated in heapq.merge(*[_read_run(f, n, key) for n, f in enumerate(runs)]):
+		yield decorated[3]
+
+class ExternalSortTest(unittest.TestCase):
+
+	def docs(self, n, seed=0):
+		rnd = random.Random(seed)
+		return [dict(_id=i, dicts=rnd.randint(1, 3), dbplace=rnd.choice([None, 1, 2, 3]), keyword='come %s' % rnd.randint(0, 50)) for i in range(n)]
+
+	def test_in_memory(self):
+		key = mongo_key(['dicts', 'dbplace', 'keyword'])
+		docs = self.docs(50)
+		self.assertEqual(list(external_sort(docs, key, run_size=100)), sorted(docs, key=key))
+		self.assertEqual(list(external_sort([], key)), [])
+
+	def test_runs(self):
+		key = mongo_key(['dicts', 'dbplace', 'keyword'])
+		docs = self.docs(1000, 1)
+		for run_size, fan_in in ((100, 64), (7, 3), (1000, 2), (1, 2)):
+			found = list(external_sort(iter(docs), key, run_size=run_size, fan_in=fan_in))
+			#sorted is stable too
+			self.assertEqual([doc['_id'] for doc in found], [doc['_id'] for doc in sorted(docs, key=key)])
+
+	def test_none_first(self):
+		key = mongo_key(['dbplace'])
+		docs = [dict(dbplace=2), dict(dbplace=None), dict(dbplace=0), dict()]
+		self.assertEqual([doc.get('dbplace') for doc in external_sort(docs, key, run_size=1)], [None, None, 0, 2])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+'''
+The crawl frontier of KeywordManager.not_so_simple_search
+'''
+import unittest
+
+def space_prefixes(keyword):
+	'''
+	Yields every p such that keyword.startswith(p+' ')
+	'''
+	i = keyword.find(' ')
+	while i != -1:
+		yield keyword[:i]
+		i = keyword.find(' ', i + 1)
+
+class Frontier(object):
+	'''
+	Keywords a dictionary has to be started for (to_start) and the sets used
+	to decide what gets in there. Every change is appended to journal so
+	that it can be checkpointed incrementally. Membership and prefix tests
+	are hashed, so they do not get slower as the frontier grows.
+	'''
+	sets = ('already_done', 'removed', 'less_than_ten')
+
+	def __init__(self):
+		self.to_start = list()
+		self.keywords = set()
+		#space prefix -> to_start keywords starting with it
+		self.children = dict()
+		self.already_done = set()
+		self.removed = set()
+		self.less_than_ten = set()
+		self.journal = list()
+
+	def _append(self, key):
+		self.to_start.append(key)
+		self.keywords.add(key.keyword)
+		for prefix in space_prefixes(key.keyword):
+			self.children.setdefault(prefix, list()).append(key.keyword)
+
+	def append(self, key):
+		self._append(key)
+		self.journal.append(('to_start', key.to_dict()))
+
+	def add(self, name, keyword):
+		s = getattr(self, name)
+		if keyword not in s:
+			s.add(keyword)
+			self.journal.append((name, keyword))
+
+	def replay(self, kind, value, factory):
+		'''
+		Apply a journaled change, factory builds a to_start key from its dict
+		'''
+		if kind == 'to_start':
+			self._append(factory(value))
+		else:
+			getattr(self, kind).add(value)
+
+	def __contains__(self, keyword):
+		return keyword in self.keywords
+
+	def starting_with(self, keyword):
+		'''
+		to_start keywords starting with keyword+' '
+		'''
+		return self.children.get(keyword, [])
+
+	def under_removed(self, keyword):
+		'''
+		True if keyword starts with a removed keyword followed by a space
+		'''
+		return any(prefix in self.removed for prefix in space_prefixes(keyword))
+
+	def flush_journal(self):
+		journal = self.journal
+		self.journal = list()
+		return journal
+
+class FrontierTest(unittest.TestCase):
+
+	class Key(object):
+		def __init__(self, keyword, **kwargs):
+			self.keyword = keyword
+		def to_dict(self):
+			return dict(keyword=self.keyword)
+
+	def test_replay(self):
+		f = Frontier()
+		f.append(self.Key('come'))
+		f.add('already_done', 'come')
+		f.add('already_done', 'come')
+		f.append(self.Key('come fare'))
+		f.add('removed', 'come fare il')
+		journal = f.flush_journal()
+		self.assertEqual(len(journal), 4)
+		self.assertEqual(f.journal, [])
+		g = Frontier()
+		for kind, value in journal:
+			g.replay(kind, value, lambda d: self.Key(**d))
+		self.assertEqual([k.keyword for k in g.to_start], ['come', 'come fare'])
+		self.assertEqual(g.already_done, set(['come']))
+		self.assertEqual(g.removed, set(['come fare il']))
+		self.assertTrue('come fare' in g)
+		self.assertEqual(g.starting_with('come'), ['come fare'])
+
+	def test_prefixes(self):
+		self.assertEqual(list(space_prefixes('come fare  il pane')), ['come', 'come fare', 'come fare ', 'come fare  il'])
+		f = Frontier()
+		f.add('removed', 'come fare')
+		self.assertTrue(f.under_removed('come fare il'))
+		self.assertFalse(f.under_removed('come fare'))
+		self.assertFalse(f.under_removed('come farei il'))
+
+if __name__ == '__main__':
+	unittest.main()
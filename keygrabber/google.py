@@ -5,16 +5,16 @@ Created on 10/02/2011
 @author: Vincenzo Ampolo <vincenzo.ampolo@gmail.com>
 '''
 import unittest
-import json
-from html.parser import HTMLParser
 from urllib.parse import urlencode
 import urllib.request, urllib.error, urllib.parse
-import re
 import time
 import logging
+from throttle import Throttle
+from proxy_pool import ProxyPool
+from http_pool import ConnectionPool
+from suggest_parser import parse_suggest
 
 log = logging.getLogger('google')
-log.addHandler(logging.FileHandler('/tmp/keygrabber-google.log', 'w'))
 
 max_answers = 10
 
@@ -33,45 +33,75 @@ class NotValidAnswerError(Error):
         self.msg = msg
 
 class Google():
-	def __init__(self, proxy=None):
-		self.html_parser = HTMLParser()
-		self.open_function = urllib.request.urlopen
-		if proxy:
-			proxy_handler = urllib.request.ProxyHandler(proxy)
-			self.opener = urllib.request.build_opener(proxy_handler)
-			self.open_function = self.opener.open
+	#number of upcoming searches the crawler should announce through prefetch()
+	lookahead = 0
+
+	#most prefetched keywords kept waiting, see async_google.AsyncGoogle
+	max_pending = 1000
+
+	#consecutive malformed answers after which NotValidAnswerError is raised
+	max_invalid = 3
+
+	url = 'http://clients1.google.it/complete/search'
+
+	def __init__(self, proxy=None, cache=None, throttle=None, proxies=None, gzip=True, url=None, recorder=None):
+		self.hl = 'it'
+		self.client = 'hp'
+		self.cache = cache
+		if url is not None:
+			self.url = url
+		#replay.Recorder saving the raw answers
+		self.recorder = recorder
+		self.throttle = throttle if throttle is not None else Throttle()
+		#requests are spread over the proxies, a single proxy is a pool of one
+		self.http = ConnectionPool(gzip=gzip)
+		self.pool = ProxyPool(proxies if proxies else [proxy], http=self.http)
             
 	def getInstantKeys(self, keyword, *args, **kwargs):
 		
 		def __get_g_json(term):
+			invalid = 0
 			while True:
+				#the throttle keeps us waiting while backing off after a failure
+				self.throttle.acquire()
+				start = time.time()
 				try: 
-					data = self.open_function('http://clients1.google.it/complete/search?'+urlencode({'q':term.encode('utf-8'), 'hl':'it', 'client':'hp'})).read()
-					break
+					data = self.pool.open(self.url+'?'+urlencode({'q':term.encode('utf-8'), 'hl':self.hl, 'client':self.client}))
 				except urllib.error.HTTPError as e:
 					if e.code == 400:
 						#we reached the end of the expansion
+						self.throttle.success(time.time() - start)
+						if self.recorder is not None:
+							self.recorder.record(term, None)
 						return []
-					time.sleep(10)
+					self.throttle.failure(e.code)
 					continue
-				except:
+				except Exception as e:
 					#something weird happened
-					log.warning('something weird happened while dealing with google instant')
-
-			HTMLtag = re.compile('<\/*b>')      # Matches HTML tags
-			data = data.decode('iso-8859-15')
-			if data[0:18] != 'window.google.ac.h':
-				raise NotValidAnswerError('answer is not valid')
-			try:
-				g_list = json.loads(data[19:-1])
-			except:
-				return []
-				
-			return [self.html_parser.unescape(HTMLtag.sub('', entry[0])) for entry in g_list[1]]
+					log.warning('something weird happened while dealing with google instant: %r', e)
+					self.throttle.failure(type(e).__name__)
+					continue
+				suggestions = parse_suggest(data)
+				if suggestions is not None:
+					self.throttle.success(time.time() - start)
+					if self.recorder is not None:
+						self.recorder.record(term, data)
+					return suggestions
+				#a ban page or a truncated answer
+				invalid = invalid + 1
+				self.throttle.failure('invalid')
+				if invalid >= self.max_invalid:
+					#not an empty answer: it is neither cached nor a leaf of the crawl
+					log.warning('answer for %r is not valid, giving up: %r', term, data[:100])
+					raise NotValidAnswerError('%s invalid answers in a row for %r' % (invalid, term))
 		
 		keywords = list()
 		log.debug(keyword)
-		g_json=__get_g_json(keyword)
+		g_json = self.cache.get(keyword, self.hl, self.client) if self.cache is not None else None
+		if g_json is None:
+			g_json=__get_g_json(keyword)
+			if self.cache is not None:
+				self.cache.set(keyword, self.hl, self.client, g_json)
 		if keyword in g_json:
 			g_json.remove(keyword)
 		for entry in g_json:
@@ -80,17 +110,62 @@ class Google():
 
 	def search(self, keyword, *args, **kwargs):
 		return self.getInstantKeys(keyword)
+
+	def prefetch(self, *keywords):
+		'''
+		Hint that keywords are going to be requested soon.
+		Google fetches on demand, see async_google.AsyncGoogle
+		'''
+		pass
+
+	def cancel(self, prefix):
+		'''
+		Hint that the keywords starting with prefix are not going to be
+		requested anymore
+		'''
+		pass
 		
-	def expand(self, keyword, level=0):
+	def expand(self, keyword, level=0, breadth_first=False):
 		'''
-		Returns an iterator which returns (expanded key, level) for each subkey found
+		Returns an iterator which returns (expanded key, level) for each subkey found.
+		The children of the answers with max_answers items are expanded too,
+		depth first or, with breadth_first, one level at a time
 		'''
+		if breadth_first:
+			return self._expand_breadth_first(keyword, level)
+		return self._expand_depth_first(keyword, level)
+
+	def _expand_depth_first(self, keyword, level=0):
 		items = self.getInstantKeys(keyword+' ')
+		if len(items) == max_answers:
+			self.prefetch(*[item+' ' for item in items])
 		for item in items:
 			yield (item, level+1)
 			if len(items) == max_answers:
-				for subitem in self.expand(item, level + 1):
+				for subitem in self._expand_depth_first(item, level + 1):
 					yield subitem
+
+	def _expand_breadth_first(self, keyword, level=0):
+		'''
+		The siblings of a level are requested ahead through prefetch(), half
+		of max_pending at a time so that none is forgotten before it is read,
+		and their answers are yielded in sibling order
+		'''
+		window = max(1, self.max_pending // 2)
+		terms = [keyword]
+		while terms:
+			self.prefetch(*[term+' ' for term in terms[:window]])
+			level = level + 1
+			next_terms = list()
+			for i, term in enumerate(terms):
+				if i + window < len(terms):
+					self.prefetch(terms[i + window]+' ')
+				items = self.getInstantKeys(term+' ')
+				for item in items:
+					yield (item, level)
+				if len(items) == max_answers:
+					next_terms.extend(items)
+			terms = next_terms
     
 class GoogleTest(unittest.TestCase):
 	
@@ -113,12 +188,27 @@ class GoogleTest(unittest.TestCase):
         
         import settings
         google=Google(settings.proxy)
-        tor_page = google.open_function('http://whatismyipaddress.com/').read()
-        page = urllib.request.urlopen('http://whatismyipaddress.com/').read()
+        tor_page = google.pool.open('http://whatismyipaddress.com/').decode('utf-8')
+        page = urllib.request.urlopen('http://whatismyipaddress.com/').read().decode('utf-8')
         tor_res = get_ip(tor_page)
         res = get_ip(page)
         self.assertNotEqual(tor_res, res)
         
+    def test_invalid_answer(self):
+        class Pool(object):
+            def open(self, url):
+                return b'<html>sorry</html>'
+        cached = list()
+        class Cache(object):
+            def get(self, *args):
+                return None
+            def set(self, *args):
+                cached.append(args)
+        google = Google(cache=Cache(), throttle=Throttle(base_delay=0.001, max_delay=0.01))
+        google.pool = Pool()
+        self.assertRaises(NotValidAnswerError, google.search, 'come ')
+        self.assertEqual(cached, [])
+
     def test_search(self):
         google = Google()
         keys = ['jzs','comeee']
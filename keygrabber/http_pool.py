@@ -0,0 +1,169 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+'''
+Keep-alive HTTP connections for the Google client
+'''
+import unittest
+import threading
+import gzip
+import http.client
+import urllib.error
+from urllib.parse import urlsplit
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+class ConnectionPool(object):
+	'''
+	Persistent HTTP/1.1 connections shared by threads. A connection is taken
+	out of the idle list of its (host, port) for a request and given back
+	afterwards, so every thread gets its own while they are reused across
+	calls. Requests through a proxy go to the proxy with the absolute url.
+	'''
+	def __init__(self, max_idle=10, timeout=30, gzip=True):
+		self.max_idle = max_idle
+		self.timeout = timeout
+		self.gzip = gzip
+		self.idle = dict()
+		self.lock = threading.Lock()
+		self.connections = 0
+
+	def _checkout(self, key, reuse=True):
+		with self.lock:
+			idle = self.idle.get(key)
+			if idle and reuse:
+				return idle.pop(), True
+			self.connections = self.connections + 1
+		return http.client.HTTPConnection(key[0], key[1], timeout=self.timeout), False
+
+	def _checkin(self, key, conn):
+		with self.lock:
+			idle = self.idle.setdefault(key, list())
+			if len(idle) < self.max_idle:
+				idle.append(conn)
+				return
+		conn.close()
+
+	def get(self, url, proxy=None):
+		'''
+		Returns the body of url, raises urllib.error.HTTPError like urlopen
+		for the errors and for the redirects too
+		'''
+		parts = urlsplit(url)
+		if proxy:
+			address = urlsplit(proxy if '://' in proxy else 'http://' + proxy)
+			key = (address.hostname, address.port or 80)
+			path = url
+		else:
+			key = (parts.hostname, parts.port or 80)
+			path = parts.path + ('?' + parts.query if parts.query else '')
+		headers = {'Host': parts.netloc}
+		if self.gzip:
+			headers['Accept-Encoding'] = 'gzip'
+		conn, reused = self._checkout(key)
+		while True:
+			try:
+				conn.request('GET', path, headers=headers)
+				response = conn.getresponse()
+				body = response.read()
+				break
+			except (http.client.HTTPException, OSError):
+				conn.close()
+				if not reused:
+					raise
+				#the server may have closed an idle connection, try once on a new one
+				conn, reused = self._checkout(key, reuse=False)
+		if response.will_close:
+			conn.close()
+		else:
+			self._checkin(key, conn)
+		if response.getheader('Content-Encoding') == 'gzip':
+			body = gzip.decompress(body)
+		#urlopen would follow a redirect, google redirects a banned client to its sorry page
+		if response.status >= 300:
+			raise urllib.error.HTTPError(url, response.status, response.reason, response.msg, None)
+		return body
+
+	def close(self):
+		with self.lock:
+			for idle in self.idle.values():
+				for conn in idle:
+					conn.close()
+			self.idle = dict()
+
+class ConnectionPoolTest(unittest.TestCase):
+
+	class Handler(BaseHTTPRequestHandler):
+		protocol_version = 'HTTP/1.1'
+
+		def setup(self):
+			BaseHTTPRequestHandler.setup(self)
+			self.server.connections += 1
+
+		def do_GET(self):
+			if self.path.endswith('missing'):
+				self.send_response(400)
+				self.send_header('Content-Length', '0')
+				self.end_headers()
+				return
+			if self.path.endswith('banned'):
+				self.send_response(302)
+				self.send_header('Location', 'http://www.google.it/sorry/')
+				self.send_header('Content-Length', '0')
+				self.end_headers()
+				return
+			body = b'window.google.ac.h(["come",[["come fare",0]],{}])'
+			self.send_response(200)
+			if 'gzip' in self.headers.get('Accept-Encoding', ''):
+				body = gzip.compress(body)
+				self.send_header('Content-Encoding', 'gzip')
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, *args):
+			pass
+
+	def setUp(self):
+		self.server = HTTPServer(('127.0.0.1', 0), self.Handler)
+		self.server.connections = 0
+		thread = threading.Thread(target=self.server.serve_forever)
+		thread.daemon = True
+		thread.start()
+		self.url = 'http://127.0.0.1:%s/complete/search?q=' % self.server.server_port
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+	def test_keep_alive(self):
+		pool = ConnectionPool()
+		for term in ('come', 'come+', 'come+f'):
+			self.assertTrue(pool.get(self.url + term).startswith(b'window.google.ac.h'))
+		self.assertRaises(urllib.error.HTTPError, pool.get, self.url + 'missing')
+		self.assertRaises(urllib.error.HTTPError, pool.get, self.url + 'banned')
+		self.assertEqual(pool.get(self.url + 'come'), pool.get(self.url + 'come'))
+		self.assertEqual(self.server.connections, 1)
+		pool.close()
+
+	def test_stale(self):
+		class Stale(object):
+			def request(self, *args, **kwargs):
+				raise ConnectionResetError()
+			def close(self):
+				stale.append(self)
+		stale = list()
+		pool = ConnectionPool()
+		pool.idle[('127.0.0.1', self.server.server_port)] = [Stale(), Stale()]
+		self.assertTrue(pool.get(self.url + 'come').startswith(b'window.google.ac.h'))
+		#one retry, on a new connection
+		self.assertEqual(len(stale), 1)
+		self.assertEqual(self.server.connections, 1)
+		pool.close()
+
+	def test_proxy(self):
+		pool = ConnectionPool(gzip=False)
+		data = pool.get('http://clients1.google.it/complete/search?q=come', '127.0.0.1:%s' % self.server.server_port)
+		self.assertTrue(data.startswith(b'window.google.ac.h'))
+		pool.close()
+
+if __name__ == '__main__':
+	unittest.main()
@@ -8,26 +8,61 @@ import sys
 import os
 import getopt
 import codecs
+import functools
+import logging
 
 
-from google import Google
+from google import Google, NotValidAnswerError
+from async_google import AsyncGoogle
+from suggest_cache import SuggestCache
+from throttle import Throttle
 from keyword_manager import KeywordManager
 from dictionary_generator import SmartDict
+from log_setup import setup_logging
 import settings
 import string
 
 
+def build_manager(options, shard=None):
+	'''
+	KeywordManager with its own google client. The worker i of a crawl
+	sharded in n processes uses one proxy in n of the pool and serves its
+	stats on stats_port+1+i
+	'''
+	cache = None
+	if options['cache_path']:
+		cache = SuggestCache(options['cache_path'], ttl=getattr(settings, 'cache_ttl', 30*24*3600), size=getattr(settings, 'cache_size', 5000000))
+	throttle = Throttle(rate=getattr(settings, 'throttle_rate', 5.0), max_rate=getattr(settings, 'throttle_max_rate', 50.0))
+	proxies = getattr(settings, 'proxies', None)
+	if shard is not None and proxies and len(proxies) >= shard[1]:
+		proxies = proxies[shard[0]::shard[1]]
+	if options['concurrency'] > 1 or options['rate']:
+		google = AsyncGoogle(settings.proxy, concurrency=options['concurrency'], rate=options['rate'], cache=cache, throttle=throttle, proxies=proxies)
+	else:
+		google = Google(settings.proxy, cache=cache, throttle=throttle, proxies=proxies)
+	stats_port = getattr(settings, 'stats_port', None)
+	if stats_port is not None and shard is not None:
+		stats_port = stats_port + 1 + shard[0]
+	di = SmartDict(size=4)
+	return KeywordManager(di, google, getattr(settings, 'flush_size', 1000), getattr(settings, 'flush_interval', 5.0), options['breadth_first'], shard=shard, stats_interval=getattr(settings, 'stats_interval', 10.0), stats_port=stats_port)
     
 def main(argv=None):
 	if argv is None:
 	   argv = sys.argv
 
-	opts, extraparams = getopt.gnu_getopt(argv[1:], "hvedo", ["help", 'export', 'drop', 'order'])
+	opts, extraparams = getopt.gnu_getopt(argv[1:], "hvedouc:r:", ["help", 'export', 'drop', 'order', 'update-order', 'concurrency=', 'rate=', 'no-cache', 'resume', 'breadth-first', 'shards='])
 
 	verbose = False
 	export = False
 	drop = False
 	order = False    
+	update_order = False
+	resume = False
+	breadth_first = getattr(settings, 'breadth_first', False)
+	concurrency = getattr(settings, 'concurrency', 1)
+	rate = getattr(settings, 'rate', None)
+	cache_path = getattr(settings, 'cache_path', None)
+	shards = getattr(settings, 'shards', 1)
 
 	for o, a in opts:
 		if o == "-v":
@@ -41,18 +76,37 @@ def main(argv=None):
 			drop = True
 		elif o in ("-o", "--order"):
 			order = True
+		elif o in ("-u", "--update-order"):
+			update_order = True
+		elif o in ("-c", "--concurrency"):
+			concurrency = int(a)
+		elif o in ("-r", "--rate"):
+			rate = float(a)
+		elif o == "--no-cache":
+			cache_path = None
+		elif o == "--resume":
+			resume = True
+		elif o == "--breadth-first":
+			breadth_first = True
+		elif o == "--shards":
+			shards = int(a)
 		else:
 			assert False, "UnhandledOption"
 
     #begin
-	google = Google(settings.proxy)
-	di = SmartDict(size=4)
-	km = KeywordManager(di, google)
+	level = logging.DEBUG if verbose else getattr(logging, getattr(settings, 'log_level', 'INFO'))
+	setup_logging(level, getattr(settings, 'log_path', '/tmp/keygrabber.log'), getattr(settings, 'log_google_path', '/tmp/keygrabber-google.log'), getattr(settings, 'log_max_bytes', 50*1024*1024), getattr(settings, 'log_backups', 5))
+	options = dict(concurrency=concurrency, rate=rate, cache_path=cache_path, breadth_first=breadth_first)
+	km = build_manager(options)
 	    
 	if order:
-		keywords = km.order_keywords()
-		print('in keygrabber: '+str(len(keywords)))
-		km.create_orderedkeys_collection(keywords)
+		count = km.create_orderedkeys_collection(km.order_keywords())
+		print('in keygrabber: '+str(count))
+		return 0
+
+	if update_order:
+		count = km.update_orderedkeys(getattr(settings, 'patch_max_share', 0.2))
+		print('in keygrabber: '+str(count))
 		return 0
     
 	if export:
@@ -63,7 +117,16 @@ def main(argv=None):
 		km.drop_database()
 		return 0
 
-	km.not_so_simple_search(base='come')
+	if shards > 1:
+		if not km.sharded_search(functools.partial(build_manager, options), base='come', shards=shards, resume=resume):
+			return 1
+	else:
+		try:
+			km.not_so_simple_search(base='come', resume=resume)
+		except NotValidAnswerError as e:
+			#banned: what has been checkpointed is kept for --resume
+			logging.getLogger('keywordManager').error('stopping the crawl, %s. It can be resumed with --resume', e)
+			return 1
 
 	return 0
             
@@ -0,0 +1,188 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+'''
+In-process indexes over the crawler collection
+'''
+import unittest
+import bisect
+import random
+
+class KeywordIndex(object):
+	'''
+	keyword -> _id of the documents of a collection. It is loaded once and
+	updated on insert, Mongo is queried only on a miss. When complete is
+	True nobody else writes the collection, so a miss is an answer too.
+	'''
+	def __init__(self, collection, complete=True):
+		self.collection = collection
+		self.complete = complete
+		self.ids = dict()
+		self.hits = 0
+		self.misses = 0
+		self.queries = 0
+
+	def load(self):
+		self.ids = dict()
+		for doc in self.collection.find({}, ['keyword']):
+			self.ids[doc.get('keyword')] = doc['_id']
+
+	def clear(self):
+		self.ids = dict()
+
+	def add(self, keyword, _id):
+		self.ids[keyword] = _id
+
+	def get(self, keyword):
+		'''
+		Returns the _id of keyword or None
+		'''
+		_id = self.ids.get(keyword)
+		if _id is not None:
+			self.hits = self.hits + 1
+			return _id
+		self.misses = self.misses + 1
+		if self.complete:
+			return None
+		self.queries = self.queries + 1
+		doc = self.collection.find_one({'keyword': keyword}, ['_id'])
+		if doc is None:
+			return None
+		self.ids[keyword] = doc['_id']
+		return doc['_id']
+
+	def __contains__(self, keyword):
+		return self.get(keyword) is not None
+
+	def __len__(self):
+		return len(self.ids)
+
+class ContainmentIndex(object):
+	'''
+	Counts the stored keywords containing a string, as an unanchored regex
+	count() on the keyword field would. The suffixes of the keywords
+	starting with anchor are kept sorted, so the ones starting with a
+	string are a range found by bisection. A keyword starting with anchor
+	is its own first suffix: the index mostly costs a list slot per
+	keyword. The suffixes added since the last merge are sorted apart and
+	merged once they are more than a sixteenth of the others. Strings not
+	starting with anchor are passed to fallback.
+	'''
+	def __init__(self, anchor='', fallback=None, merge_size=4096):
+		self.anchor = anchor
+		self.fallback = fallback
+		self.merge_size = merge_size
+		self.clear()
+
+	def clear(self):
+		#the first suffix of every keyword
+		self.suffixes = list()
+		self.pending = list()
+		#(suffix, shared) of the other suffixes of a keyword, shared is the longest prefix it has in common with an earlier one
+		self.repeated = list()
+		self.total = 0
+
+	def load(self, collection):
+		self.clear()
+		for doc in collection.find({}, ['keyword']):
+			self.add(doc.get('keyword'))
+
+	def add(self, keyword):
+		self.total = self.total + 1
+		starts = list()
+		start = keyword.find(self.anchor)
+		while start != -1 and start < len(keyword):
+			starts.append(start)
+			start = keyword.find(self.anchor, start + 1)
+		if not starts:
+			return
+		bisect.insort(self.pending, keyword[starts[0]:])
+		if len(self.pending) > max(self.merge_size, len(self.suffixes) >> 4):
+			self.suffixes.extend(self.pending)
+			self.suffixes.sort()
+			self.pending = list()
+		for n, start in enumerate(starts[1:]):
+			shared = max(_common_prefix(keyword, before, start) for before in starts[:n + 1])
+			bisect.insort(self.repeated, (keyword[start:], shared))
+
+	def count(self, keyword):
+		if keyword == '':
+			return self.total
+		if not keyword.startswith(self.anchor):
+			return self.fallback(keyword)
+		after = keyword[:-1] + chr(ord(keyword[-1]) + 1)
+		count = 0
+		for suffixes in (self.suffixes, self.pending):
+			count = count + bisect.bisect_left(suffixes, after) - bisect.bisect_left(suffixes, keyword)
+		#a suffix sharing keyword with an earlier one of its keyword is counted already
+		for suffix, shared in self.repeated[bisect.bisect_left(self.repeated, (keyword,)):bisect.bisect_left(self.repeated, (after,))]:
+			if shared < len(keyword):
+				count = count + 1
+		return count
+
+def _common_prefix(keyword, a, b):
+	'''
+	Length of the common prefix of the suffixes of keyword at a and b
+	'''
+	n = 0
+	while b + n < len(keyword) and keyword[a + n] == keyword[b + n]:
+		n = n + 1
+	return n
+
+class KeywordIndexTest(unittest.TestCase):
+
+	class Collection(object):
+		def __init__(self, docs):
+			self.docs = docs
+			self.queries = 0
+		def find(self, spec, fields):
+			return iter(self.docs)
+		def find_one(self, spec, fields):
+			self.queries += 1
+			for doc in self.docs:
+				if doc['keyword'] == spec['keyword']:
+					return doc
+			return None
+
+	def test_complete(self):
+		c = self.Collection([dict(_id=1, keyword='come'), dict(_id=2, keyword='come fare')])
+		index = KeywordIndex(c)
+		index.load()
+		self.assertTrue('come fare' in index)
+		self.assertFalse('come stai' in index)
+		index.add('come stai', 3)
+		self.assertEqual(index.get('come stai'), 3)
+		self.assertEqual(c.queries, 0)
+
+	def test_miss(self):
+		c = self.Collection([dict(_id=1, keyword='come')])
+		index = KeywordIndex(c, complete=False)
+		c.docs.append(dict(_id=2, keyword='come fare'))
+		self.assertEqual(index.get('come fare'), 2)
+		self.assertEqual(index.get('come fare'), 2)
+		self.assertEqual(c.queries, 1)
+
+class ContainmentIndexTest(unittest.TestCase):
+
+	def test_count(self):
+		keywords = ['come', 'come fare', 'come fare come fare', 'come si dice come stai', 'benvenuto welcome fare', 'come stai']
+		index = ContainmentIndex('come', fallback=lambda k: sum(1 for x in keywords if k in x))
+		for keyword in keywords:
+			index.add(keyword)
+		for keyword in ['come', 'come ', 'come fare', 'come fa', 'come stai', 'come si', 'come zz', 'ome fare', 'fare', '']:
+			self.assertEqual(index.count(keyword), sum(1 for x in keywords if keyword in x))
+
+	def test_merges(self):
+		rnd = random.Random(0)
+		keywords = ['come ' + ' '.join(rnd.choice(['fare', 'come', 'stai', 'si', 'co']) for i in range(rnd.randint(0, 4))) for n in range(300)]
+		for anchor in ('come', ''):
+			added = list()
+			index = ContainmentIndex(anchor, fallback=lambda k: sum(1 for x in added if k in x), merge_size=8)
+			for keyword in keywords:
+				index.add(keyword)
+				added.append(keyword)
+				if len(added) % 50 == 0:
+					for string in ['come', 'come come', 'come fare come', 'come s', 'co', 'stai', 'e c']:
+						self.assertEqual(index.count(string), sum(1 for x in added if string in x), (anchor, string))
+
+if __name__ == '__main__':
+	unittest.main()
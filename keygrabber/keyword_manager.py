@@ -8,20 +8,25 @@
 import unittest
 import pymongo
 import logging
+import multiprocessing
+import time
+import functools
 from google import Google, max_answers
 from dictionary_generator import SmartDict
+from frontier import Frontier
+from checkpoint import Checkpoint
+from keyword_index import KeywordIndex, ContainmentIndex
+from write_buffer import WriteBuffer
+from sharding import shard_of, ShardInbox
+from metrics import Metrics
+from crawl_order import ordered_keywords, crawl_spec, order_key, ORDER, KEY_FIELDS
+from publish import publish, patch, published, forget_published, record_changes, changed_ids
 import re
 from string import ascii_lowercase
 import itertools
 
-
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(message)s')
-
+#handlers are set up by log_setup.setup_logging
 log = logging.getLogger('keywordManager')
-hdlr = logging.FileHandler('/tmp/keygrabber.log', 'w')
-formatter = logging.Formatter('%(asctime)s %(message)s')
-hdlr.setFormatter(formatter)
-log.addHandler(hdlr)
 
 class InstantKeywordMongo(object):
 	def __init__(self, keyword=None, parent=None, category=None, level=None, dicts=None, depth=None, place=None, dbplace=None, second_choice = False,  **kwargs):
@@ -53,13 +58,41 @@ class InstantKeywordMongo(object):
 
             
 class KeywordManager():    
-	def __init__(self, dictionary, s_eng):
+	def __init__(self, dictionary, s_eng, flush_size=1000, flush_interval=5.0, breadth_first=False, shard=None, stats_interval=10.0, stats_port=None, db_name='webkeywords'):
 		self.keywords = list()
 		self.s_eng = s_eng
+		self.breadth_first = breadth_first
+		#(i, n): this is the worker i of a crawl sharded in n processes
+		self.shard = shard
 		self.connection = pymongo.Connection()
-		self.db = self.connection.webkeywords
+		self.db = self.connection[db_name]
 		self.collection = self.db.crawler
-		self.collection.ensure_index('keyword')
+		self.checkpoint = Checkpoint(self.db, 'crawler' if shard is None else 'crawler-%s' % shard[0])
+		#the other workers write the collection too
+		self.index = KeywordIndex(self.collection, complete=shard is None)
+		#what changed since orderedkeys was published, see update_orderedkeys
+		#a keyword stored first by another worker keeps its _id
+		self.writer = WriteBuffer(self.collection, flush_size, flush_interval, self.__record_changes, shared=shard is not None, rejected=self.index.add)
+		#orderedkeys has been published, so it can be patched with the changes
+		self.tracking = False
+		self.containment = ContainmentIndex(fallback=self.__count_containing)
+		self.inbox = ShardInbox(self.db, shard)
+		self.taken = list()
+		self.last_id = None
+		self.metrics = Metrics(interval=stats_interval)
+		if stats_port is not None:
+			self.metrics.serve(stats_port)
+		self.__ensure_indexes()
+
+	def __ensure_indexes(self):
+		#the crawls before the sharded mode have a keyword index which is not unique
+		index = self.collection.index_information().get('keyword_1')
+		if index is not None and not index.get('unique'):
+			log.warning('rebuilding the keyword index as unique, only the first copy of a keyword is kept')
+			self.collection.drop_index('keyword_1')
+		self.collection.ensure_index('keyword', unique=True, dropDups=True)
+		#walked by fast_order
+		self.collection.ensure_index(ORDER)
 		self.collection.ensure_index([('level',pymongo.ASCENDING), ('dicts', pymongo.ASCENDING), ('depth', pymongo.ASCENDING), ('place', pymongo.ASCENDING)])
 		self.collection.ensure_index([('level',pymongo.ASCENDING), ('dicts', pymongo.ASCENDING), ('depth', pymongo.ASCENDING), ('dbplace', pymongo.ASCENDING)])
 
@@ -82,25 +115,69 @@ class KeywordManager():
 			parent_k = InstantKeywordMongo('', None, None, 0, 0, 0, 0)
 			parent_keyword = ''
 		else:
-			p_k = self.collection.find_one({'keyword':parent_k.keyword})
-			if p_k is None:
-				p_k = self.collection.find_one({'keyword': parent_k.parent})
-				
-			parent_keyword = p_k.get('keyword')
+			parent_keyword = parent_k.keyword if parent_k.keyword in self.index else parent_k.parent
 		for keyword in keywords:
-			result = self.collection.find_one({'keyword':keyword})
-			if result is None:
-				log.debug('keyword NOT found in database: '+ keyword)
+			if keyword not in self.index:
+				log.debug('keyword NOT found in database: %s', keyword)
 				key_entry= InstantKeywordMongo(keyword, parent_keyword, parent_k.category, d_lev[keyword] if d_lev else parent_k.level, parent_k.dicts, parent_k.depth, keywords.index(keyword)+1, len(keys)+1, parent_k.second_choice)
-				key_entry._id = self.collection.insert(key_entry.to_dict())
+				doc = key_entry.to_dict()
+				if self.shard is not None:
+					#removed on resume if written after the checkpoint of the shard
+					doc['shard'] = self.shard[0]
+				key_entry._id = self.writer.insert(doc)
+				self.index.add(keyword, key_entry._id)
+				self.containment.add(keyword)
+				self.last_id = key_entry._id
+				self.metrics.incr('keywords')
 				if parent_k._id is not None and parent_k.has_child is False:
 					parent_k.has_child = True
-					self.collection.save(parent_k.to_dict())
+					self.writer.set_has_child(parent_k._id)
 				keys.append(key_entry)
 			else:
-				log.debug('keyword found in database: '+ keyword)
+				log.debug('keyword found in database: %s', keyword)
 		return keys       
     
+	def __record_changes(self, ids):
+		'''
+		Until orderedkeys is published its next publish is a full one, the
+		changes are recorded from then on
+		'''
+		if not self.tracking:
+			self.tracking = published(self.db) is not None
+		if self.tracking:
+			record_changes(self.db, ids)
+
+	def __forget_published(self):
+		forget_published(self.db)
+		self.tracking = False
+
+	def __discard(self, spec, batch_size=1000):
+		'''
+		Removes the keywords of spec, written after the checkpoint, and takes
+		has_child back from their parents left without children. Both are
+		changes of orderedkeys
+		'''
+		docs = list(self.collection.find(spec, ['parent']))
+		self.collection.remove(spec)
+		changed = [doc['_id'] for doc in docs]
+		parents = list(set(doc.get('parent') for doc in docs))
+		for i in range(0, len(parents), batch_size):
+			batch = parents[i:i + batch_size]
+			#at most a flush of keywords is written after a checkpoint, so this is about one query
+			kept = set(self.collection.find({'parent': {'$in': batch}}).distinct('parent'))
+			childless = {'keyword': {'$in': [parent for parent in batch if parent not in kept]}, 'has_child': True}
+			ids = [doc['_id'] for doc in self.collection.find(childless, ['_id'])]
+			if ids:
+				self.collection.update({'_id': {'$in': ids}}, {'$set': {'has_child': False}}, multi=True)
+				changed.extend(ids)
+		if changed:
+			self.__record_changes(changed)
+
+	def __count_containing(self, keyword):
+		self.writer.flush()
+		self.metrics.incr('containment_queries')
+		return self.collection.find(dict(keyword=re.compile(re.escape(keyword)))).count()
+
 	def order_keywords(self, *args, **kwargs):
 		return self.fast_order()
 	    
@@ -111,36 +188,197 @@ class KeywordManager():
 			print('%s, %s, %s, %s, %s, %s' % (key.get('keyword'), key.get('index'), key.get('dicts'), key.get('level'), key.get('depth'), key.get('dbplace')))
 	
 	def drop_database(self):
+		self.writer.clear()
 		self.collection.drop()
+		self.__forget_published()
+		self.index.clear()
+		self.containment.clear()
+		self.checkpoint.clear()
+		self.inbox.clear()
 		
-	def create_orderedkeys_collection(self, inst_list):
-		#add index
-		log.info('adding index')
-		for i, key in enumerate(inst_list):
-			key['index']=i 
-		#save to orderedkeys collection
-		self.db.orderedkeys.drop()
-		log.info('adding ordered keys :'+str(len(inst_list)))
-		a = self.db.orderedkeys.insert(inst_list)
-		self.db.orderedkeys.ensure_index('index')
-		print(len(a))
-		return inst_list
+	def create_orderedkeys_collection(self, inst_list, batch_size=1000):
+		'''
+		Publish the keywords of inst_list, any iterable, with their index to
+		orderedkeys, which is replaced only once complete.
+		Returns the number of keywords
+		'''
+		log.info('adding ordered keys')
+		crawl = crawl_spec(self.collection)
+		meta = dict(order='crawl', root=crawl[1], max_dicts=crawl[2]) if crawl is not None else None
+		#the sorts of webkeywords
+		count = publish(self.db, inst_list, 'orderedkeys', ('index', [('global_searches', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)]), batch_size, meta)
+		log.info('added ordered keys :%s', count)
+		print(count)
+		return count
+
+	def update_orderedkeys(self, max_share=0.2, batch_size=1000):
+		'''
+		Patch orderedkeys in place with the crawler documents changed since
+		it was published: their index, has_child and parent are written
+		again, the documents gone or no longer in the order are removed.
+		It is published from scratch when the crawl order changed or more
+		than max_share of it changed.
+		Returns the number of keywords written
+		'''
+		self.writer.flush()
+		crawl = crawl_spec(self.collection)
+		meta = published(self.db)
+		if crawl is None or meta is None:
+			return self.create_orderedkeys_collection(self.order_keywords(), batch_size)
+		spec, prefix, max_dicts = crawl
+		#the changes recorded from now on are left to the next patch
+		started = time.time()
+		ids = changed_ids(self.db)
+		if meta.get('order') != 'crawl' or meta.get('root') != prefix or max_dicts < meta.get('max_dicts') or min(max_dicts, meta.get('max_dicts')) <= 1 or len(ids) > max_share * meta.get('count'):
+			return self.create_orderedkeys_collection(self.order_keywords(), batch_size)
+		grown = None
+		if max_dicts > meta.get('max_dicts'):
+			#the old last dictionary is in the order now, it counts as changed
+			grown = dict(spec, dicts={'$gte': meta.get('max_dicts'), '$lt': max_dicts})
+			if len(ids) + self.collection.find(grown).count() > max_share * meta.get('count'):
+				return self.create_orderedkeys_collection(self.order_keywords(), batch_size)
+		docs = dict()
+		for i in range(0, len(ids), batch_size):
+			for doc in self.collection.find(dict(spec, _id={'$in': ids[i:i + batch_size]})):
+				docs[doc['_id']] = doc
+		if grown is not None:
+			for doc in self.collection.find(grown):
+				docs[doc['_id']] = doc
+		removed = [_id for _id in ids if _id not in docs]
+		log.info('patching ordered keys: %s changed, %s removed', len(docs), len(removed))
+		count = patch(self.db, docs.values(), removed, functools.partial(order_key, offset=len(prefix)), 'orderedkeys', KEY_FIELDS, dict(order='crawl', root=prefix, max_dicts=max_dicts), batch_size, started)
+		if count is None:
+			log.warning('no room left between the indexes of orderedkeys, publishing it again')
+			return self.create_orderedkeys_collection(self.order_keywords(), batch_size)
+		log.info('patched ordered keys :%s', count)
+		return count
 		
 	
-	def not_so_simple_search(self, base='', **kwargs):
+	def __owns(self, keyword, base):
+		return self.shard is None or shard_of(keyword, base, self.shard[1]) == self.shard[0]
+
+	def __push(self, frontier, key, base):
+		'''
+		Add a root to the frontier, or to the inbox of the worker owning it
+		'''
+		if self.__owns(key.keyword, base):
+			frontier.append(key)
+		else:
+			self.inbox.post(shard_of(key.keyword, base, self.shard[1]), key.to_dict())
+			frontier.add('already_done', key.keyword)
+
+	def __wait_inbox(self, frontier, **state):
+		'''
+		Checkpoint and append to the frontier the roots posted by the other
+		workers, returns False when the sharded crawl is over. Two workers
+		can post the same root, the roots already in the frontier are
+		acknowledged and the worker waits again
+		'''
+		if self.shard is None:
+			return False
+		while True:
+			with self.metrics.timer('checkpoint'):
+				self.writer.flush()
+				self.checkpoint.save(frontier, **state)
+			self.publish_stats(frontier, state['position'])
+			self.inbox.ack(self.taken)
+			self.taken = self.inbox.wait()
+			if not self.taken:
+				return False
+			appended = False
+			for item in self.taken:
+				key = InstantKeywordMongo(**item['key'])
+				if key.keyword not in frontier and key.keyword not in frontier.already_done:
+					frontier.append(key)
+					appended = True
+			if appended:
+				return True
+
+	def sharded_search(self, factory, base='', shards=2, resume=False):
+		'''
+		Crawl base with shards worker processes, factory(shard) builds the
+		KeywordManager of a worker in its own process. Every worker crawls
+		the roots whose first letter after base is its own, the unique index
+		on keyword drops the keywords found by two workers at the same time
+		'''
+		self.inbox.reset()
+		if not resume:
+			self.writer.clear()
+			self.collection.drop()
+			self.__forget_published()
+			self.index.clear()
+			self.inbox.clear()
+			self.__ensure_indexes()
+			self.collection.insert(InstantKeywordMongo(base, None, None, 0, 0, 0).to_dict())
+		workers = [multiprocessing.Process(target=crawl_shard, args=(factory, base, (i, shards), resume)) for i in range(shards)]
+		for worker in workers:
+			worker.start()
+		for worker in workers:
+			worker.join()
+		failed = [i for i, worker in enumerate(workers) if worker.exitcode != 0]
+		if failed:
+			log.error('shards %s failed, the crawl can be resumed', failed)
+			return False
+		log.warning('Ordering and publishing')
+		self.update_orderedkeys()
+		return True
+	
+	def publish_stats(self, frontier=None, position=0):
+		'''
+		Snapshot of the crawl metrics, saved to crawler_stats under the name
+		of the checkpoint and served on stats_port
+		'''
+		#the mongo requests of the crawl itself, with containment_queries: checkpoints, inbox and stats are left out
+		counters = dict(write_ops=self.writer.ops, index_queries=self.index.queries)
+		gauges = dict(_id=self.checkpoint.name, shard=self.shard)
+		throttle = getattr(self.s_eng, 'throttle', None)
+		if throttle is not None:
+			counters['requests'] = throttle.requests
+			counters['retries'] = throttle.retries
+			gauges['throttle_rate'] = throttle.rate
+		cache = getattr(self.s_eng, 'cache', None)
+		if cache is not None:
+			stats = cache.stats()
+			counters['cache_hits'] = stats['hits']
+			counters['cache_misses'] = stats['misses']
+			gauges['cache_hit_rate'] = stats['hit_rate']
+		if frontier is not None:
+			gauges['frontier'] = len(frontier.to_start) - position
+			gauges['dictionaries'] = position
+		snapshot = self.metrics.snapshot(counters, **gauges)
+		snapshot['keywords_per_minute'] = round(snapshot['per_second'].get('keywords', 0) * 60, 1)
+		self.db.crawler_stats.save(snapshot)
+		return snapshot
+
+	def not_so_simple_search(self, base='', resume=False, **kwargs):
+		'''
+		Crawl google instant starting from base. The crawl is checkpointed
+		between two searches every time the write buffer gets flushed, with
+		resume=True it restarts from the last checkpoint instead of dropping
+		the crawler collection. A worker of a sharded crawl searches only its
+		roots and leaves ordering to sharded_search
+		'''
 		level = 0
 		dicts = 0
-		to_start_dict = list()
-		to_start_dict_removed = set()
-		already_done_dicts = set()
-		to_start_dict_less_of_ten_results = set()
+		position = 0
+		state = None
+		if resume:
+			state, frontier = self.checkpoint.load(lambda d: InstantKeywordMongo(**d))
+			if state is None:
+				log.warning('no checkpoint found, starting a new crawl')
+		if state is None:
+			frontier = Frontier()
+		to_start_dict = frontier.to_start
+		to_start_dict_removed = frontier.removed
+		already_done_dicts = frontier.already_done
+		to_start_dict_less_of_ten_results = frontier.less_than_ten
 						
 		def expand(mkey, *args, **kwargs):
 			'''
 			Expand and add all the keywords found based on a keyword
 			'''
 			#TODO: split the extended in multiple keywords
-			r_search = self.s_eng.expand(mkey.keyword, mkey.level)
+			r_search = self.s_eng.expand(mkey.keyword, mkey.level, breadth_first=self.breadth_first)
 			keys = list()
 			keys_got = list()
 			for k, lev in r_search:
@@ -148,141 +386,182 @@ class KeywordManager():
 			keys.extend(self.__add_keywords_to_database(parent_k=mkey, expanded_list=keys_got))       
 			return keys
 		
-		self.collection.drop()
 		ilist=list()	
-		#first of all look for keywords with just the BASE
-		base_k = InstantKeywordMongo(base, None, None, level, dicts, 0)
-		base_k._id = self.collection.insert(base_k.to_dict())
-		to_start_dict.append(base_k)			
+		if state is None:
+			self.checkpoint.clear()
+			#first of all look for keywords with just the BASE
+			base_k = InstantKeywordMongo(base, None, None, level, dicts, 0)
+			if self.shard is None:
+				self.writer.clear()
+				self.collection.drop()
+				self.__forget_published()
+				self.index.clear()
+				self.__ensure_indexes()
+				base_k._id = self.writer.insert(base_k.to_dict())
+				self.index.add(base, base_k._id)
+			else:
+				#written by sharded_search, the keywords of a run of this shard stopped before its first checkpoint are crawled again
+				self.__discard({'shard': self.shard[0]})
+				base_k._id = self.index.get(base)
+			self.containment.anchor = base
+			self.containment.clear()
+			self.containment.add(base)
+			self.last_id = base_k._id
+			frontier.append(base_k)
+		else:
+			base = state['base']
+			base_k = InstantKeywordMongo(base, None, None, level, dicts, 0)
+			dicts = state['dicts']
+			position = state['position']
+			self.last_id = state['last_id']
+			#throw away what has been written after the checkpoint, it is going to be crawled again
+			if self.shard is None:
+				self.__discard({'_id': {'$gt': self.last_id}})
+			else:
+				self.__discard({'shard': self.shard[0], '_id': {'$gt': self.last_id}})
+			self.index.load()
+			self.containment.anchor = base
+			self.containment.load(self.collection)
+			log.warning('resuming crawl of %s from dict %s after word %r', base, dicts, state['word'])
+			if position >= len(to_start_dict):
+				#checkpointed while waiting for the inbox
+				state = None
 		
-		for key in to_start_dict:
-			if key.keyword in already_done_dicts:
-				log.warning('found keyword which has already been processed... skipping ' + key.keyword)
-				continue
-			if key.keyword in to_start_dict_less_of_ten_results:
-				log.warning('this keyword has been removed... skipping '+ key.keyword)
-				continue
-				
-			dicts = dicts + 1
-			d = SmartDict(size=4)
-			log.warning('starting dict for ='+key.keyword) 
-			already_done_dicts.add(key.keyword)
-			for word in d.get():
+		while position < len(to_start_dict) or self.__wait_inbox(frontier, base=base, position=position, dicts=dicts, word=None, blacklist=[], last_id=self.last_id):
+			key = to_start_dict[position]
+			position = position + 1
+			if state is None:
+				if key.keyword in already_done_dicts:
+					log.warning('found keyword which has already been processed... skipping %s', key.keyword)
+					continue
+				if key.keyword in to_start_dict_less_of_ten_results:
+					log.warning('this keyword has been removed... skipping %s', key.keyword)
+					continue
+					
+				dicts = dicts + 1
+				blacklist = list()
+				if key.keyword == base and self.shard is not None:
+					#the words of the base starting with the letters of the other workers
+					blacklist = [c for c in ascii_lowercase if not self.__owns(base+' '+c, base)]
+				d = SmartDict(size=4, blacklist=blacklist)
+				log.warning('starting dict for =%s', key.keyword)
+				if self.s_eng.cache is not None:
+					log.warning('suggest cache: %(hits)s hits, %(misses)s misses, hit rate %(hit_rate).2f', self.s_eng.cache.stats())
+				log.warning('throttle: %s', self.s_eng.throttle.stats())
+				log.warning('proxies: %s', self.s_eng.pool.stats())
+				frontier.add('already_done', key.keyword)
+				words = d.get()
+				done_word = None
+			else:
+				d = SmartDict(size=4, blacklist=state['blacklist'])
+				done_word = state['word']
+				words = d.get(after=done_word)
+				state = None
+			for word in words:
+				if self.writer.due():
+					#everything up to done_word is in the buffer, so it is going to be in mongo too
+					with self.metrics.timer('checkpoint'):
+						self.writer.flush()
+						self.checkpoint.save(frontier, base=base, position=position-1, dicts=dicts, word=done_word, blacklist=d.blacklist, last_id=self.last_id)
+				if self.metrics.due():
+					self.publish_stats(frontier, position)
+				done_word = word
+				if word == '' and not self.__owns(key.keyword+' ', base):
+					continue
 				ilist=list()
-				log.debug('SEARCHING for ='+key.keyword+' '+word)
+				if self.s_eng.lookahead:
+					self.s_eng.prefetch(*[key.keyword+' '+w for w in d.peek(self.s_eng.lookahead)])
+				log.debug('SEARCHING for =%s %s', key.keyword, word)
 				key = InstantKeywordMongo(key.keyword, key.parent, None, level, dicts, len(word), second_choice = key.second_choice)
-				r_search = self.s_eng.search(key.keyword+' '+word)
+				with self.metrics.timer('search'):
+					r_search = self.s_eng.search(key.keyword+' '+word)
+				self.metrics.incr('searches')
 				keyws = self.__add_keywords_to_database(r_search, key)
 				for x in keyws:
-					log.debug('ADDED into the database: '+x.keyword)
+					log.debug('ADDED into the database: %s', x.keyword)
 				ilist.extend(keyws)
 				if len(r_search) < max_answers:
 					d.jump()
-					log.debug('reached < 10 answers and SmartDict word is '+word)
+					#the words prefetched under it are pruned too
+					self.s_eng.cancel(key.keyword+' '+word)
+					log.debug('reached < 10 answers and SmartDict word is %s', word)
 					#key_to_check = key.keyword+' '+word+' ' if word != '' else key.keyword+' '
 					if word == '':
-						key_to_check = key.keyword+' '
-						for x in to_start_dict:
-							if x.keyword.startswith(key_to_check) and x.keyword not in to_start_dict_less_of_ten_results:
-								log.debug('removing '+x.keyword+' from the list_of_dict')
-								to_start_dict_less_of_ten_results.add(x.keyword)
+						for x in frontier.starting_with(key.keyword):
+							if x not in to_start_dict_less_of_ten_results:
+								log.debug('removing %s from the list_of_dict', x)
+								frontier.add('less_than_ten', x)
 					continue
 				
 				
 				log.debug('starting expansion results >= 10')
+				self.s_eng.prefetch(*[keyw.keyword+' ' for keyw in keyws])
 				for keyw in keyws:
 					#TODO: valuate if i should add keyw into to_start_dict
-					log.debug('expanding :'+keyw.keyword)
-					exp_ress = expand(keyw)
-					log.debug('Len of expanded and added to database keywords is '+str(len(exp_ress)))
+					log.debug('expanding :%s', keyw.keyword)
+					with self.metrics.timer('expand'):
+						exp_ress = expand(keyw)
+					self.metrics.incr('expansions')
+					log.debug('Len of expanded and added to database keywords is %s', len(exp_ress))
 					ilist.extend(exp_ress)
 					
 				for x in ilist:
-					log.debug('Evaluating :'+x.keyword)
+					log.debug('Evaluating :%s', x.keyword)
 					'''
 						Adding multiple dicts support
 						Add a keyword to the list of keywords to start in any case
 					'''
+					start = time.time()
 					keyword = x.keyword[len(base_k.keyword):]
-					log.debug('decomposing: '+ x.keyword)
+					log.debug('decomposing: %s', x.keyword)
 					past_words = ''
 					for word in keyword.split()[:-1]:
 						possible_keyword = base_k.keyword + past_words +' '+ word
-						if all(y.keyword != possible_keyword for y in to_start_dict) and not any(possible_keyword.startswith(x+' ') for x in to_start_dict_removed) and possible_keyword not in to_start_dict_removed and possible_keyword not in already_done_dicts:
+						if possible_keyword not in frontier and not frontier.under_removed(possible_keyword) and possible_keyword not in to_start_dict_removed and possible_keyword not in already_done_dicts:
 							parent = None
 							i = 0
-							log.debug('found that we should start a dictionary for '+ possible_keyword)
+							log.debug('found that we should start a dictionary for %s', possible_keyword)
 							while parent is None:
 								i = i + 1
-								parent = self.collection.find_one({'keyword':' '.join(possible_keyword.split()[:-i])})
-							log.debug('parent for  '+ possible_keyword + ' is ' + parent.get('keyword'))
-							k = InstantKeywordMongo(possible_keyword, parent.get('keyword'), None, 0, 0, 0, second_choice=True)
+								candidate = ' '.join(possible_keyword.split()[:-i])
+								if candidate in self.index:
+									parent = candidate
+							log.debug('parent for  %s is %s', possible_keyword, parent)
+							k = InstantKeywordMongo(possible_keyword, parent, None, 0, 0, 0, second_choice=True)
 							#k._id = self.collection.insert(k.to_dict())
-							to_start_dict.append(k)
-							log.debug('ADDED to the list of dict :'+k.keyword+ ' and second_choice is'+ str(k.second_choice))
+							self.__push(frontier, k, base)
+							log.debug('ADDED to the list of dict :%s and second_choice is %s', k.keyword, k.second_choice)
 						past_words = past_words + ' ' + word
+					self.metrics.add_time('decompose', time.time() - start)
 								
-					if self.collection.find(dict(keyword=re.compile(re.escape(x.keyword)))).count() >= max_answers:
-						if all(y.keyword != x.keyword for y in to_start_dict) and x.keyword not in already_done_dicts:
-							to_start_dict.append(x)
-							log.debug('ADDED to the list of dict :'+x.keyword)
+					with self.metrics.timer('subtree'):
+						containing = self.containment.count(x.keyword)
+					if containing >= max_answers:
+						if x.keyword not in frontier and x.keyword not in already_done_dicts:
+							self.__push(frontier, x, base)
+							log.debug('ADDED to the list of dict :%s', x.keyword)
 					else:
-						to_start_dict_removed.add(x.keyword)
-						log.debug('added to the list of to_start_dict_removed '+ x.keyword)
+						frontier.add('removed', x.keyword)
+						log.debug('added to the list of to_start_dict_removed %s', x.keyword)
 							
+		self.writer.flush()
+		self.checkpoint.save(frontier, base=base, position=position, dicts=dicts, word=None, blacklist=[], last_id=self.last_id)
 		log.warning('Algorithm Finished')
+		log.warning('crawl stats: %s', self.publish_stats(frontier, position))
+		if self.s_eng.cache is not None:
+			log.warning('suggest cache: %(hits)s hits, %(misses)s misses, hit rate %(hit_rate).2f', self.s_eng.cache.stats())
+		if self.shard is not None:
+			return
 		log.warning('Ordering and publishing')
-		keywords = self.order_keywords()
-		self.create_orderedkeys_collection(keywords)
+		self.update_orderedkeys()
 		
 	def fast_order(self):
 		'''
-		Algorithm which creates index ffor the keywords based on the values got from the crawler
+		Algorithm which creates index ffor the keywords based on the values got from the crawler.
+		Returns an iterator, see crawl_order.ordered_keywords
 		'''
 		log.warning('Start fast ordering')
-		
-		inst_list = list()
-		cursors = list()
-		wrong_list = list()
-		
-		def _update_threshold(dicts= 100, level = 7, depth =4, dbplace=10):	
-			m_dicts = 1
-			m_level = 0
-			m_depth = 0
-			m_dbplace = 1
-			
-			yield (m_dicts, m_level, m_depth, m_dbplace)
-			
-			while m_dicts < dicts:
-				m_dbplace = m_dbplace + 1
-				if m_dbplace > dbplace:
-					m_depth = m_depth +1
-					m_dbplace = 1
-				if m_depth > depth:
-					m_level = m_level + 1
-					m_depth = 0
-					m_dbplace = 0
-				if m_level > level:
-					m_dicts = m_dicts +1
-					m_level = 0
-					m_depth = 0
-					m_dbplace = 0
-				yield (m_dicts, m_level, m_depth, m_dbplace)
-		
-		root = self.collection.find_one(dict(dicts=0, parent=None))
-		max_dicts = self.collection.find().sort([('dicts',pymongo.DESCENDING),])[0].get('dicts')
-		max_level = self.collection.find().sort([('level',pymongo.DESCENDING),])[0].get('level')
-		max_depth = self.collection.find().sort([('depth',pymongo.DESCENDING),])[0].get('depth')
-		max_dbplace = self.collection.find().sort([('dbplace',pymongo.DESCENDING),])[0].get('dbplace')
-
-		for (dicts, level, depth, dbplace) in _update_threshold(max_dicts, max_level, max_depth, max_dbplace):
-			log.info("threashold:"+str(dicts)+" "+str(level)+" "+str(depth)+" "+str(dbplace))
-			for letter in ascii_lowercase:
-				items = [item for item in self.collection.find(dict(keyword=re.compile('^'+root.get('keyword')+' '+letter), dicts=dicts, level=level, depth=depth, dbplace=dbplace))]
-				if len(items) > 0:
-					inst_list.extend(items)
-			log.info("successfully ordered :"+str(len(inst_list)))
-		return inst_list
+		return ordered_keywords(self.collection)
 			
 		
 	def order_and_publish(self):
@@ -291,122 +570,134 @@ class KeywordManager():
 		Perform a fast and incomplete order
 		'''
 		log.warning('Starting ordering')
-		inst_list = list()
-		res = list()
-		res_index = list()
-		root = self.collection.find_one(dict(dicts=0, parent=None))
-		ten_items = self.collection.find(dict(parent=root.get('keyword'), dicts=1))[:10]
-		ten_items_list = [x for x in ten_items]
-		inst_list.extend(ten_items_list)
-		max_items = 0
-		for letter in ascii_lowercase:
-			items = self.collection.find(dict(keyword=re.compile(root.get('keyword')+' '+letter))).sort([('dicts', pymongo.ASCENDING), ('level', pymongo.ASCENDING), ('depth', pymongo.ASCENDING), ('dbplace', pymongo.ASCENDING), ('keyword', pymongo.ASCENDING)])
-			n_items = items.count()
-			items.batch_size(1000)
-			res.append(items)
-			res_index.append(0)
-			max_items = n_items if n_items >= max_items else max_items
-		log.info('cursors built')	
+		inst_list = smart_ordered_keywords(self.collection)
 		
-		def smart_ordering(cursors, **kwargs):			
+		#add index
+		log.info('do ordering')
+		#save to orderedkeys collection
+		publish(self.db, inst_list)
+		return []
+		return inst_list
 			
-			cursors_indexes = [0 for i in cursors]
-			base_list = kwargs.get('base_list', list())
-			dicts = 1
-			level = 0
-			depth = 0
-			dbplace = 1
+
+def smart_ordered_keywords(collection):
+	'''
+	The order of the deprecated KeywordManager.order_and_publish, a list
+	'''
+	inst_list = list()
+	res = list()
+	res_index = list()
+	root = collection.find_one(dict(dicts=0, parent=None))
+	ten_items = collection.find(dict(parent=root.get('keyword'), dicts=1))[:10]
+	ten_items_list = [x for x in ten_items]
+	inst_list.extend(ten_items_list)
+	max_items = 0
+	for letter in ascii_lowercase:
+		items = collection.find(dict(keyword=re.compile(root.get('keyword')+' '+letter))).sort([('dicts', pymongo.ASCENDING), ('level', pymongo.ASCENDING), ('depth', pymongo.ASCENDING), ('dbplace', pymongo.ASCENDING), ('keyword', pymongo.ASCENDING)])
+		n_items = items.count()
+		items.batch_size(1000)
+		res.append(items)
+		res_index.append(0)
+		max_items = n_items if n_items >= max_items else max_items
+	log.info('cursors built')	
+	
+	def smart_ordering(cursors, **kwargs):			
+		
+		cursors_indexes = [0 for i in cursors]
+		base_list = kwargs.get('base_list', list())
+		dicts = 1
+		level = 0
+		depth = 0
+		dbplace = 1
+		
+		skipped_counter = [0, 0, 0, 0]
 			
-			skipped_counter = [0, 0, 0, 0]
-				
-			def continue_iteration(cursors):
-				return False if all([cursor.count() <= cursors_indexes[cursors.index(cursor)] for cursor in cursors]) else True
-				
-			def __update_counter(counter, value):
-				if counter >= 26:
-					value = value +1 
-					return 0, value
-				else:
-					return counter + 1, value
+		def continue_iteration(cursors):
+			return False if all([cursor.count() <= cursors_indexes[cursors.index(cursor)] for cursor in cursors]) else True
 			
-			start_from_a = False
-			while continue_iteration(cursors):
-				for cursor in cursors:
-					c_index = cursors.index(cursor)
-					if start_from_a:
-						if c_index != 0:
-							break
-						else:
-							start_from_a = False
-					index = cursors_indexes[c_index]
-					while cursor.count() > index:
-						if cursor[index] in base_list:
-							index=index+1
-						else:
-							key = cursor[index]
-							log.info('selected key ' + key.get('keyword'))
-							log.info('counters%s' % (str(skipped_counter),))
-							log.info('threshold: dicts: %s level: %s depth: %s dbplace: %s' % (dicts, level, depth, dbplace))
-							if key.get('dicts') <= dicts:
-								#skipped_counter[0] = 0
-								if key.get('level') <= level: 
-									#skipped_counter[1] = 0
-									if key.get('depth') <= depth:
-										#skipped_counter[2] = 0
-										if key.get('dbplace') <= dbplace:
-											#skipped_counter[3] = 0
-											print('added')
-											inst_list.append(key)
-											cursors_indexes[c_index] = index + 1
-											print('updating index: ', cursors_indexes[c_index])
-											yield key
-										else:
-											skipped_counter[3], dbplace = __update_counter(skipped_counter[3], dbplace) 
-											if skipped_counter[3] == 0:
-												start_from_a = True
+		def __update_counter(counter, value):
+			if counter >= 26:
+				value = value +1 
+				return 0, value
+			else:
+				return counter + 1, value
+		
+		start_from_a = False
+		while continue_iteration(cursors):
+			for cursor in cursors:
+				c_index = cursors.index(cursor)
+				if start_from_a:
+					if c_index != 0:
+						break
+					else:
+						start_from_a = False
+				index = cursors_indexes[c_index]
+				while cursor.count() > index:
+					if cursor[index] in base_list:
+						index=index+1
+					else:
+						key = cursor[index]
+						log.info('selected key %s', key.get('keyword'))
+						log.info('counters%s', skipped_counter)
+						log.info('threshold: dicts: %s level: %s depth: %s dbplace: %s', dicts, level, depth, dbplace)
+						if key.get('dicts') <= dicts:
+							#skipped_counter[0] = 0
+							if key.get('level') <= level: 
+								#skipped_counter[1] = 0
+								if key.get('depth') <= depth:
+									#skipped_counter[2] = 0
+									if key.get('dbplace') <= dbplace:
+										#skipped_counter[3] = 0
+										log.debug('added')
+										inst_list.append(key)
+										cursors_indexes[c_index] = index + 1
+										log.debug('updating index: %s', cursors_indexes[c_index])
+										yield key
 									else:
-										skipped_counter[2], depth = __update_counter(skipped_counter[2], depth) 
-										if skipped_counter[2] == 0:
-											dbplace = 0
+										skipped_counter[3], dbplace = __update_counter(skipped_counter[3], dbplace) 
+										if skipped_counter[3] == 0:
 											start_from_a = True
 								else:
-									skipped_counter[1], level = __update_counter(skipped_counter[1], level)
-									if skipped_counter[1] == 0:
-										depth = 0
+									skipped_counter[2], depth = __update_counter(skipped_counter[2], depth) 
+									if skipped_counter[2] == 0:
 										dbplace = 0
 										start_from_a = True
 							else:
-								skipped_counter[0], dicts = __update_counter(skipped_counter[0], dicts)
-								if skipped_counter[0] == 0:
+								skipped_counter[1], level = __update_counter(skipped_counter[1], level)
+								if skipped_counter[1] == 0:
 									depth = 0
-									level = 0
 									dbplace = 0
 									start_from_a = True
-							break
-		
-		inst_list.extend([i for i in smart_ordering(res, base_list=inst_list)])
-		
-		#add index
-		log.info('do ordering')
-		for i, key in enumerate(inst_list):
-			key['index']=i 
-		#save to orderedkeys collection
-		self.db.orderedkeys.drop()
-		self.db.orderedkeys.insert(inst_list)
-		return []
-		return inst_list
-			
+						else:
+							skipped_counter[0], dicts = __update_counter(skipped_counter[0], dicts)
+							if skipped_counter[0] == 0:
+								depth = 0
+								level = 0
+								dbplace = 0
+								start_from_a = True
+						break
+	
+	inst_list.extend([i for i in smart_ordering(res, base_list=inst_list)])
+	return inst_list
+
+def crawl_shard(factory, base, shard, resume):
+	'''
+	Entry point of the worker processes of KeywordManager.sharded_search
+	'''
+	km = factory(shard)
+	km.not_so_simple_search(base=base, resume=resume)
 						
 class KeywordManagerTest(unittest.TestCase):
     
     def test_mongo_class(self):
         a = InstantKeywordMongo('test',0)
         print(a.to_dict())
-        km = KeywordManager(None, None, None)
-        print(km.collection.insert(a))
+        km = KeywordManager(None, None, db_name='keygrabber_test')
+        print(km.collection.insert(a.to_dict()))
+        km.drop_database()
         
     def test_export(self):
-        km = KeywordManager(None, None, None)
+        km = KeywordManager(None, None, db_name='keygrabber_test')
         km.export_keywords()
     
 
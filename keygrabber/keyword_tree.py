@@ -0,0 +1,98 @@
+# -*- coding: UTF-8 -*-
+'''
+Keyword hierarchy built on the adwords traffic
+'''
+import unittest
+import random
+
+def traffic(key):
+	'''
+	global_searches of a key, missing counts as 0 and None below anything
+	like in the python 2 comparisons of the original ordering
+	'''
+	value = key.get('global_searches', 0)
+	return -1 if value is None else value
+
+class WordTrie(object):
+	'''
+	Keys by their keyword split on spaces, a node is [key, children]
+	'''
+	def __init__(self, keys=()):
+		self.root = [None, dict()]
+		for key in keys:
+			self.add(key)
+
+	def add(self, key):
+		node = self.root
+		for word in key.get('keyword').split(' '):
+			node = node[1].setdefault(word, [None, dict()])
+		node[0] = key
+
+	def ancestors(self, keyword):
+		'''
+		Keys whose keyword followed by a space starts keyword, nearest first
+		'''
+		found = list()
+		node = self.root
+		for word in keyword.split(' ')[:-1]:
+			node = node[1].get(word)
+			if node is None:
+				break
+			if node[0] is not None:
+				found.append(node[0])
+		found.reverse()
+		return found
+
+def assign_parents(keys):
+	'''
+	The parent of a key is its nearest ancestor with at least its traffic:
+	"come scaricare musica" is a child of "come scaricare" if it is not
+	searched more. Keys without such an ancestor keep their parent, the
+	keys some other one has as parent get has_child. Returns keys sorted
+	by decreasing traffic.
+	'''
+	keys.sort(key=traffic, reverse=True)
+	trie = WordTrie(keys)
+	for key in keys:
+		limit = traffic(key)
+		for ancestor in trie.ancestors(key.get('keyword')):
+			if traffic(ancestor) >= limit:
+				key['parent'] = ancestor.get('keyword')
+				break
+	parents = set(key.get('parent') for key in keys)
+	for key in keys:
+		key['has_child'] = key.get('keyword') in parents
+	return keys
+
+class AssignParentsTest(unittest.TestCase):
+
+	def test_example(self):
+		keys = [dict(keyword='come scaricare musica', global_searches=100, parent='come'),
+			dict(keyword='come', global_searches=None, parent=None),
+			dict(keyword='come scaricare', global_searches=10000, parent='come'),
+			dict(keyword='come scaricare musica gratis', global_searches=1000, parent='come scaricare musica'),
+			dict(keyword='come scaricare musica da youtube', global_searches=100, parent='come scaricare musica')]
+		keys = assign_parents(keys)
+		parents = dict((key['keyword'], key['parent']) for key in keys)
+		self.assertEqual(parents['come scaricare musica'], 'come scaricare')
+		self.assertEqual(parents['come scaricare musica gratis'], 'come scaricare')
+		self.assertEqual(parents['come scaricare musica da youtube'], 'come scaricare musica')
+		self.assertEqual(parents['come scaricare'], 'come')
+		self.assertEqual([key['keyword'] for key in keys if key['has_child']], ['come scaricare', 'come scaricare musica', 'come'])
+
+	def test_brute_force(self):
+		rnd = random.Random(0)
+		words = ['come', 'fare', 'il', 'pane', 'a', 'casa', '']
+		keywords = set(' '.join(rnd.choice(words) for i in range(rnd.randint(1, 5))) for j in range(400))
+		keys = [dict(keyword=keyword, global_searches=rnd.choice([None, 0, 10, 100, 1000])) for keyword in keywords]
+		keys = assign_parents(keys)
+		for key in keys:
+			candidates = [k for k in keys if key['keyword'].startswith(k['keyword'] + ' ') and traffic(k) >= traffic(key)]
+			if candidates:
+				nearest = max(candidates, key=lambda k: len(k['keyword']))
+				self.assertEqual(key['parent'], nearest['keyword'])
+			else:
+				self.assertFalse('parent' in key)
+
+if __name__ == '__main__':
+	unittest.main()
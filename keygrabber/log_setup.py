@@ -0,0 +1,69 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+'''
+Logging of the crawler processes
+'''
+import unittest
+import os
+import tempfile
+import atexit
+import multiprocessing
+import logging
+import logging.handlers
+
+FORMAT = '%(asctime)s %(message)s'
+
+def setup_logging(level=logging.INFO, path='/tmp/keygrabber.log', google_path='/tmp/keygrabber-google.log', max_bytes=50*1024*1024, backups=5, console=True):
+	'''
+	Log records are put in a queue and formatted and written by a listener
+	thread, so the crawl does not wait for the disk. The keywordManager and
+	google loggers go to their own rotating files, everything goes to
+	stderr when console is set. The queue is a multiprocessing one: worker
+	processes forked afterwards log through the listener of their parent.
+	Returns the listener, which is stopped at exit.
+	'''
+	formatter = logging.Formatter(FORMAT)
+	handlers = list()
+	for name, filename in (('keywordManager', path), ('google', google_path)):
+		if filename:
+			handler = logging.handlers.RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+			handler.setFormatter(formatter)
+			handler.addFilter(logging.Filter(name))
+			handlers.append(handler)
+	if console:
+		handler = logging.StreamHandler()
+		handler.setFormatter(formatter)
+		handlers.append(handler)
+	queue = multiprocessing.Queue(-1)
+	listener = logging.handlers.QueueListener(queue, *handlers)
+	root = logging.getLogger()
+	for handler in list(root.handlers):
+		root.removeHandler(handler)
+	root.addHandler(logging.handlers.QueueHandler(queue))
+	root.setLevel(level)
+	listener.start()
+	atexit.register(listener.stop)
+	return listener
+
+class LogSetupTest(unittest.TestCase):
+
+	def test_rotation(self):
+		d = tempfile.mkdtemp()
+		path = os.path.join(d, 'keygrabber.log')
+		google_path = os.path.join(d, 'keygrabber-google.log')
+		listener = setup_logging(logging.INFO, path, google_path, max_bytes=200, backups=2, console=False)
+		for i in range(20):
+			logging.getLogger('keywordManager').info('searching for %s %s', 'come', i)
+		logging.getLogger('keywordManager').debug('not written %s', 'come')
+		logging.getLogger('google').warning('proxy %s ejected', 'localhost')
+		listener.stop()
+		atexit.unregister(listener.stop)
+		logging.getLogger().handlers = list()
+		self.assertEqual(sorted(os.listdir(d)), ['keygrabber-google.log', 'keygrabber.log', 'keygrabber.log.1', 'keygrabber.log.2'])
+		with open(path) as f:
+			self.assertTrue(f.read().rstrip().endswith('searching for come 19'))
+		with open(google_path) as f:
+			self.assertTrue('proxy localhost ejected' in f.read())
+
+if __name__ == '__main__':
+	unittest.main()
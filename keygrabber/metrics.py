@@ -0,0 +1,136 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+'''
+Counters and phase timings of a crawl
+'''
+import unittest
+import threading
+import time
+import json
+from collections import deque
+from contextlib import contextmanager
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import urllib.request
+
+class Metrics(object):
+	'''
+	Cumulative counters and time spent per phase. Every snapshot() samples
+	the counters, rates are the growth over the last window seconds. The
+	last snapshot can be served as json on a local port.
+	'''
+	def __init__(self, window=60.0, interval=10.0):
+		self.window = window
+		self.interval = interval
+		self.lock = threading.Lock()
+		self.started = time.time()
+		self.last_snapshot = 0
+		self.counters = dict()
+		#phase -> [calls, seconds]
+		self.phases = dict()
+		self.samples = deque()
+		self.last = dict()
+		self.server = None
+
+	def incr(self, name, n=1):
+		with self.lock:
+			self.counters[name] = self.counters.get(name, 0) + n
+
+	def add_time(self, phase, seconds):
+		with self.lock:
+			p = self.phases.get(phase)
+			if p is None:
+				p = self.phases[phase] = [0, 0.0]
+			p[0] = p[0] + 1
+			p[1] = p[1] + seconds
+
+	@contextmanager
+	def timer(self, phase):
+		start = time.time()
+		try:
+			yield
+		finally:
+			self.add_time(phase, time.time() - start)
+
+	def due(self):
+		return time.time() - self.last_snapshot >= self.interval
+
+	def snapshot(self, counters=None, **gauges):
+		'''
+		counters are cumulative values kept elsewhere (e.g. by the throttle),
+		they get a rate like the internal ones. gauges are reported as they are
+		'''
+		now = time.time()
+		with self.lock:
+			values = dict(self.counters)
+			if counters:
+				values.update(counters)
+			self.samples.append((now, values))
+			while len(self.samples) > 1 and self.samples[0][0] < now - self.window:
+				self.samples.popleft()
+			phases = dict((name, list(p)) for name, p in self.phases.items())
+		then, old = self.samples[0]
+		elapsed = now - then
+		rates = dict((name, round((value - old.get(name, 0)) / elapsed, 2) if elapsed > 0 else 0.0) for name, value in values.items())
+		total = sum(p[1] for p in phases.values())
+		timings = dict((name, dict(calls=calls, seconds=round(seconds, 3), avg_ms=round(1000 * seconds / calls, 3) if calls else 0.0, share=round(seconds / total, 3) if total else 0.0)) for name, (calls, seconds) in phases.items())
+		snapshot = dict(time=now, uptime=round(now - self.started, 1), counters=values, per_second=rates, phases=timings)
+		snapshot.update(gauges)
+		self.last_snapshot = now
+		self.last = snapshot
+		return snapshot
+
+	def serve(self, port, host='127.0.0.1'):
+		'''
+		Serves the last snapshot as json from a daemon thread
+		'''
+		metrics = self
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				body = json.dumps(metrics.last, sort_keys=True).encode('utf-8')
+				self.send_response(200)
+				self.send_header('Content-Type', 'application/json')
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+			def log_message(self, *args):
+				pass
+		self.server = HTTPServer((host, port), Handler)
+		thread = threading.Thread(target=self.server.serve_forever)
+		thread.daemon = True
+		thread.start()
+		return self.server.server_port
+
+	def close(self):
+		if self.server is not None:
+			self.server.shutdown()
+			self.server.server_close()
+			self.server = None
+
+class MetricsTest(unittest.TestCase):
+
+	def test_snapshot(self):
+		m = Metrics()
+		m.snapshot(counters=dict(requests=0))
+		with m.timer('search'):
+			time.sleep(0.02)
+		m.add_time('expand', 0.06)
+		m.incr('keywords', 10)
+		time.sleep(0.01)
+		s = m.snapshot(counters=dict(requests=5), frontier=3)
+		self.assertEqual(s['counters'], dict(keywords=10, requests=5))
+		self.assertTrue(s['per_second']['requests'] > 0)
+		self.assertEqual(s['frontier'], 3)
+		self.assertEqual(s['phases']['search']['calls'], 1)
+		self.assertTrue(s['phases']['search']['seconds'] >= 0.02)
+		self.assertTrue(s['phases']['expand']['share'] > 0.5)
+
+	def test_serve(self):
+		m = Metrics()
+		port = m.serve(0)
+		m.snapshot(frontier=1)
+		data = json.loads(urllib.request.urlopen('http://127.0.0.1:%s/' % port).read().decode('utf-8'))
+		self.assertEqual(data['frontier'], 1)
+		m.close()
+
+if __name__ == '__main__':
+	unittest.main()
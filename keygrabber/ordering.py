@@ -1,9 +1,15 @@
 # -*- coding: UTF-8 -*-
 from adwords import keyword_adwords as kad
+import sys
+import time
 import pymongo
 import logging
 from string import ascii_lowercase
 import re
+from multiprocessing.pool import ThreadPool
+from publish import publish, patch, published, record_changes, changed_ids
+from keyword_tree import assign_parents
+from crawl_order import FAST_ORDER, fast_order_key, fast_ordered_keywords, external_ordered_keywords
 
 log = logging.getLogger('ordering')
 log.addHandler(logging.FileHandler('/tmp/keygrabber-ordering.log', 'w'))
@@ -13,29 +19,18 @@ DB = connection.webkeywords
 CL_IN = DB.crawler
 CL_OUT = DB.orderedkeys
 
-def create_ordered_collection(inst_list):
+def create_ordered_collection(inst_list, meta=None):
 	'''
-	Create the CL_OUT collection adding an index element
+	Create the CL_OUT collection adding an index element, inst_list can be
+	any iterable. CL_OUT is swapped in once complete, meta tells which
+	order it has (see publish.publish)
 	'''
-	#add index
-	log.info('adding index')
-	for i, key in enumerate(inst_list):
-		key['index']=i 
-	#save to orderedkeys collection
-	CL_OUT.drop()
-	log.info('adding ordered keys :'+str(len(inst_list)))
-	i=0
-	maximum = len(inst_list)
+	log.info('adding ordered keys')
+	maximum = publish(DB, inst_list, CL_OUT.name, ('index', 'parent', [('global_searches', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)]), meta=meta)
 	print '#keywords: ', maximum
-	while i < maximum:
-		j = i + 1000 if i + 1000 < maximum else maximum
-		a = CL_OUT.insert(inst_list[i:j])
-		i = j
-	CL_OUT.ensure_index('index')
-	CL_OUT.ensure_index('parent')
 	log.info('collection created successfully')
 	print CL_OUT.find().count()
-	return inst_list
+	return maximum
 
 def retrieve_data_from_db(limit=0):
 	keys = list()
@@ -43,25 +38,89 @@ def retrieve_data_from_db(limit=0):
 		keys.append(item)
 	return keys
 	
-def get_adwords_data(keys):	
+def _get_batch_info(batch, retries=1):
+	'''
+	adwords data of a batch of keys, None if the requests keep failing
+	'''
+	keywords = list(set(item.get('keyword') for item in batch))
+	for attempt in range(retries + 1):
+		try:
+			return batch, kad.get_keywords_info(keywords)
+		except Exception, e:
+			log.warning('adwords request of %s keywords failed: %r', len(keywords), e)
+	return batch, None
+
+def save_adwords_data(batch):
+	'''
+	One update for all the keys of batch with the same searches
+	'''
+	groups = dict()
+	for item in batch:
+		searches = (item.get('global_searches'), item.get('regional_searches'))
+		groups.setdefault(searches, list()).append(item['_id'])
+	for (global_searches, regional_searches), ids in groups.items():
+		CL_IN.update({'_id': {'$in': ids}}, {'$set': {'global_searches': global_searches, 'regional_searches': regional_searches}}, multi=True)
+	#patched into CL_OUT, once it has been published
+	if published(DB, CL_OUT.name) is not None:
+		record_changes(DB, [item['_id'] for item in batch])
+
+class AdwordsError(Exception):
+	'''
+	Raised when the adwords data of some batches of keys is missing
+	'''
+	def __init__(self, batches):
+		Exception.__init__(self, 'adwords data of %s keywords missing' % sum(len(batch) for batch in batches))
+		self.batches = batches
+
+def _save_batches(pool, batches, total):
 	'''
-	Get adwords data and save it
+	Gets and saves the adwords data of batches, returns the failed ones
 	'''
-	for item in keys:
-		d = kad.get_keyword_info(item.get('keyword'))
-		item['global_searches'] = int(d.get('global_searches')) if d.get('global_searches') else None
-		item['regional_searches'] = int(d.get('regional_searches')) if d.get('regional_searches') else None
-		CL_IN.save(item)
+	failed = list()
+	done = 0
+	for batch, info in pool.imap_unordered(_get_batch_info, batches):
+		if info is None:
+			failed.append(batch)
+			continue
+		for item in batch:
+			d = info.get(item.get('keyword'), dict())
+			item['global_searches'] = int(d.get('global_searches')) if d.get('global_searches') else None
+			item['regional_searches'] = int(d.get('regional_searches')) if d.get('regional_searches') else None
+		save_adwords_data(batch)
+		done = done + len(batch)
+		log.info('adwords data of %s/%s keywords', done, total)
+	return failed
+
+def get_adwords_data(keys, batch_size=kad.BATCH_SIZE, workers=4, retry_delay=60):	
+	'''
+	Get adwords data and save it. batch_size keywords are sent per STATS
+	request, workers requests at a time. The batches failing after their
+	retries are tried again at the end, after retry_delay seconds. If they
+	fail again AdwordsError is raised: their keys would be ordered as keys
+	without traffic
+	'''
+	batches = [keys[i:i + batch_size] for i in range(0, len(keys), batch_size)]
+	pool = ThreadPool(workers)
+	try:
+		failed = _save_batches(pool, batches, len(keys))
+		if failed:
+			log.warning('adwords data of %s batches missing, trying them again in %ss', len(failed), retry_delay)
+			time.sleep(retry_delay)
+			failed = _save_batches(pool, failed, sum(len(batch) for batch in failed))
+	finally:
+		pool.close()
+		pool.join()
+	if failed:
+		raise AdwordsError(failed)
 	return keys
 	
 def order_by_adwords_data(keys):
-	keys.sort(key=lambda x: int(x.get('global_searches')) if x.get('global_searches') is not None else 0, reverse=True)
-	for key in keys:
-		for k in keys:
-			if key.get('keyword').startswith(k.get('keyword')+' ') and k.get('global_searches', 0) >= key.get('global_searches', 0):
-				print 'parent of', key.get('keyword'), ' is ', k.get('keyword')
-				key['has_child'] = True
-				break
+	'''
+	Sort keys by global searches and give each one the nearest ancestor
+	with at least its traffic as parent, see keyword_tree.assign_parents
+	'''
+	keys = assign_parents(keys)
+	log.info('parents assigned to %s keywords', len(keys))
 	return keys
 
 def adwords_ordering(limit = 0):
@@ -88,8 +147,8 @@ def adwords_ordering(limit = 0):
 	'''
 	keys = retrieve_data_from_db(limit)
 	keys = get_adwords_data(keys)
-	#ordered_keys = order_by_adwords_data(keys)
-	#create_ordered_collection(ordered_keys)
+	ordered_keys = order_by_adwords_data(keys)
+	create_ordered_collection(ordered_keys, dict(order='adwords'))
 		
 def fast_order():
 	'''
@@ -186,13 +245,55 @@ def fast_order():
 
 	return inst_list
 	'''
-	CL_IN.ensure_index([('dicts',pymongo.ASCENDING),('level',pymongo.ASCENDING),('depth',pymongo.ASCENDING),('dbplace',pymongo.ASCENDING),('keyword',pymongo.ASCENDING)])
-	return [item for item in CL_IN.find().sort([('dicts',pymongo.ASCENDING),('level',pymongo.ASCENDING),('depth',pymongo.ASCENDING),('dbplace',pymongo.ASCENDING),('keyword',pymongo.ASCENDING)])]
+	return fast_ordered_keywords(CL_IN)
+
+def external_order(run_size=100000, tmpdir=None):
+	'''
+	The order of fast_order without the mongo sort and its index: the
+	crawler collection is read in natural order and sorted on disk, with
+	at most run_size keys in memory, see external_sort
+	'''
+	log.warning('Start external ordering')
+	return external_ordered_keywords(CL_IN, run_size, tmpdir)
 
 def do_fast_order():
 	ordered_keys = fast_order()
-	create_ordered_collection(ordered_keys)
+	return create_ordered_collection(ordered_keys, dict(order='fast'))
+
+def do_external_order(run_size=100000, tmpdir=None):
+	ordered_keys = external_order(run_size, tmpdir)
+	return create_ordered_collection(ordered_keys, dict(order='fast'))
+
+def do_incremental_order(max_share=0.2, batch_size=1000):
+	'''
+	Patch CL_OUT in place with the crawler documents changed since
+	do_fast_order published it, see publish.patch. It is ordered again
+	from scratch if it has another order or more than max_share of it
+	changed
+	'''
+	meta = published(DB, CL_OUT.name)
+	#the changes recorded from now on are left to the next patch
+	started = time.time()
+	ids = changed_ids(DB)
+	if meta is None or meta.get('order') != 'fast' or len(ids) > max_share * meta.get('count'):
+		return do_fast_order()
+	items = list()
+	for i in range(0, len(ids), batch_size):
+		items.extend(CL_IN.find({'_id': {'$in': ids[i:i + batch_size]}}))
+	found = set(item['_id'] for item in items)
+	removed = [_id for _id in ids if _id not in found]
+	count = patch(DB, items, removed, fast_order_key, CL_OUT.name, FAST_ORDER, dict(order='fast'), batch_size, started)
+	if count is None:
+		log.warning('no room left between the indexes of %s, ordering again', CL_OUT.name)
+		return do_fast_order()
+	log.info('patched %s keywords, %s removed', count, len(removed))
+	return count
 	
 if __name__ == "__main__":
-	do_fast_order()
+	if '--incremental' in sys.argv[1:]:
+		do_incremental_order()
+	elif '--external' in sys.argv[1:]:
+		do_external_order()
+	else:
+		do_fast_order()
 	#adwords_ordering()
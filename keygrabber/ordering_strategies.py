@@ -0,0 +1,117 @@
+# -*- coding: UTF-8 -*-
+'''
+The orderings of the crawled keywords behind one interface: a strategy
+takes the crawler collection and yields its documents in the order of
+the production code it wraps, order() gives them their index. See
+bench_ordering.py to compare them.
+
+A strategy takes the collection, not a stream of its documents: the
+production orderings query mongo themselves, with an index-backed sort
+or cursors per letter, and that work is part of what they cost.
+'''
+import unittest
+import random
+from string import ascii_lowercase
+
+from crawl_order import ordered_keywords, fast_ordered_keywords, external_ordered_keywords, fast_order_key
+from keyword_tree import assign_parents
+
+#name: strategy(collection, **options)
+STRATEGIES = dict()
+#the strategies sorting on disk, they take a run_size option
+ON_DISK = ('external',)
+#largest crawl of the quadratic strategies: smart sends a query per keyword and scans the keywords it took
+MAX_SIZE = dict(smart=10000)
+
+def strategy(name):
+	def register(function):
+		STRATEGIES[name] = function
+		return function
+	return register
+
+def order(name, collection, **options):
+	'''
+	Yields the documents of the crawler collection in the order of the
+	strategy name with their position in the index field
+	'''
+	for index, doc in enumerate(STRATEGIES[name](collection, **options)):
+		doc['index'] = index
+		yield doc
+
+@strategy('keyword_manager')
+def keyword_manager(collection):
+	'''
+	KeywordManager.fast_order
+	'''
+	return ordered_keywords(collection)
+
+@strategy('fast')
+def fast(collection):
+	'''
+	ordering.fast_order
+	'''
+	return fast_ordered_keywords(collection)
+
+@strategy('external')
+def external(collection, run_size=100000):
+	'''
+	ordering.external_order
+	'''
+	return external_ordered_keywords(collection, run_size)
+
+@strategy('adwords')
+def adwords(collection):
+	'''
+	ordering.adwords_ordering without the AdWords requests: the documents
+	need their global_searches already
+	'''
+	return iter(assign_parents(list(collection.find())))
+
+@strategy('smart')
+def smart(collection):
+	'''
+	KeywordManager.order_and_publish, deprecated
+	'''
+	from keyword_manager import smart_ordered_keywords
+	return iter(smart_ordered_keywords(collection))
+
+def synthetic_crawl(size, base='come', seed=0):
+	'''
+	Yields a crawl of size keywords of base, the same ones for a seed,
+	without holding it in memory
+	'''
+	rnd = random.Random(seed)
+	yield dict(_id=0, keyword=base, parent=None, dicts=0, level=0, depth=0, dbplace=None, has_child=True)
+	parents = [base]
+	for i in range(1, size):
+		keyword = '%s %s%s %x' % (base, rnd.choice(ascii_lowercase), rnd.choice(['are', 'sta', 'ove', '']), i)
+		doc = dict(_id=i, keyword=keyword, parent=rnd.choice(parents), dicts=rnd.randint(1, 4), level=rnd.randint(0, 3), depth=rnd.randint(0, 4), dbplace=rnd.randint(1, 10), has_child=False, global_searches=rnd.choice([None, 0, 10, 100, 1000, 10000]))
+		if len(parents) < 100:
+			parents.append(keyword)
+		yield doc
+
+class StrategiesTest(unittest.TestCase):
+
+	def collection(self, size=500):
+		from crawl_order import OrderedKeywordsTest
+		class Collection(OrderedKeywordsTest.Collection):
+			def ensure_index(self, index):
+				pass
+		return Collection(list(synthetic_crawl(size)))
+
+	def test_contract(self):
+		#smart needs the cursors of pymongo
+		for name in sorted(set(STRATEGIES) - set(['smart'])):
+			ordered = list(order(name, self.collection()))
+			self.assertTrue(len(ordered) > 0, name)
+			self.assertEqual([doc['index'] for doc in ordered], list(range(len(ordered))), name)
+			self.assertEqual(len(set(doc['_id'] for doc in ordered)), len(ordered), name)
+
+	def test_same_order(self):
+		expected = [doc['_id'] for doc in sorted(synthetic_crawl(500), key=fast_order_key)]
+		self.assertEqual([doc['_id'] for doc in fast(self.collection())], expected)
+		self.assertEqual([doc['_id'] for doc in external(self.collection(), run_size=64)], expected)
+		self.assertEqual([doc['_id'] for doc in keyword_manager(self.collection())], [doc['_id'] for doc in ordered_keywords(self.collection())])
+
+if __name__ == '__main__':
+	unittest.main()
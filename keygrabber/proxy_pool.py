@@ -0,0 +1,164 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+'''
+Pool of proxies for the Google client, with health scoring
+'''
+import unittest
+import threading
+import random
+import time
+import urllib.error
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import logging
+from http_pool import ConnectionPool
+
+log = logging.getLogger('google')
+
+class ProxyEntry(object):
+	def __init__(self, proxy):
+		self.proxy = proxy
+		#address of the http proxy, None for a direct connection
+		self.address = proxy.get('http') if proxy else None
+		self.latency = None
+		self.error_rate = 0.0
+		self.consecutive = 0
+		self.ejections = 0
+		self.ejected_until = 0
+		self.requests = 0
+
+	def score(self, default_latency):
+		'''
+		Expected cost of a request, the lower the better
+		'''
+		latency = self.latency if self.latency is not None else default_latency
+		return latency * (1 + 4 * self.error_rate)
+
+	def stats(self):
+		return dict(proxy=self.proxy, requests=self.requests, latency=round(self.latency, 3) if self.latency is not None else None, error_rate=round(self.error_rate, 3), ejected=self.ejected_until > time.time())
+
+class ProxyPool(object):
+	'''
+	Spreads requests over proxies, picking them at random with a probability
+	inversely proportional to their score. The score grows with the average
+	latency and the recent error rate. After max_errors consecutive failures
+	a proxy is ejected for eject_time seconds, doubled at every ejection up
+	to max_eject. A proxy of None means a direct connection. Connections to
+	the proxies are kept alive in the shared http ConnectionPool.
+	'''
+	def __init__(self, proxies, max_errors=3, eject_time=60.0, max_eject=3600.0, http=None):
+		self.entries = [ProxyEntry(proxy) for proxy in proxies]
+		self.http = http if http is not None else ConnectionPool()
+		self.max_errors = max_errors
+		self.eject_time = eject_time
+		self.max_eject = max_eject
+		self.lock = threading.Lock()
+
+	def pick(self):
+		with self.lock:
+			now = time.time()
+			healthy = [entry for entry in self.entries if entry.ejected_until <= now]
+			if not healthy:
+				#everybody is ejected: use the one coming back first
+				return min(self.entries, key=lambda entry: entry.ejected_until)
+			known = [entry.latency for entry in healthy if entry.latency is not None]
+			default_latency = sum(known) / len(known) if known else 1.0
+			weights = [1.0 / max(entry.score(default_latency), 0.001) for entry in healthy]
+			return random.choices(healthy, weights)[0]
+
+	def report(self, entry, ok, latency=None):
+		with self.lock:
+			entry.requests = entry.requests + 1
+			entry.error_rate = 0.9 * entry.error_rate + (0.0 if ok else 0.1)
+			if ok:
+				entry.consecutive = 0
+				entry.ejections = 0
+				entry.latency = latency if entry.latency is None else 0.8 * entry.latency + 0.2 * latency
+				return
+			entry.consecutive = entry.consecutive + 1
+			if entry.consecutive >= self.max_errors:
+				eject = min(self.max_eject, self.eject_time * 2 ** entry.ejections)
+				entry.ejections = entry.ejections + 1
+				entry.consecutive = 0
+				entry.ejected_until = time.time() + eject
+				log.warning('proxy %s ejected for %ss', entry.proxy, eject)
+
+	def open(self, url):
+		'''
+		Fetches url through a proxy of the pool and returns the body.
+		A 400 is an answer of google, not a failure of the proxy.
+		'''
+		entry = self.pick()
+		start = time.time()
+		try:
+			data = self.http.get(url, entry.address)
+		except urllib.error.HTTPError as e:
+			self.report(entry, e.code == 400, time.time() - start)
+			raise
+		except Exception:
+			self.report(entry, False)
+			raise
+		self.report(entry, True, time.time() - start)
+		return data
+
+	def stats(self):
+		return [entry.stats() for entry in self.entries]
+
+class ProxyPoolTest(unittest.TestCase):
+
+	class StubProxy(BaseHTTPRequestHandler):
+		'''
+		Answers every proxied request with a canned suggest answer, or with
+		a 503 when the server is marked broken
+		'''
+		def do_GET(self):
+			self.server.hits += 1
+			if self.server.broken:
+				self.send_error(503)
+				return
+			body = b'window.google.ac.h(["come",[["come fare",0]],{}])'
+			self.send_response(200)
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, *args):
+			pass
+
+	def start_proxy(self, broken):
+		server = HTTPServer(('127.0.0.1', 0), self.StubProxy)
+		server.hits = 0
+		server.broken = broken
+		thread = threading.Thread(target=server.serve_forever)
+		thread.daemon = True
+		thread.start()
+		self.servers.append(server)
+		return {'http': '127.0.0.1:%s' % server.server_port}
+
+	def setUp(self):
+		self.servers = list()
+
+	def tearDown(self):
+		for server in self.servers:
+			server.shutdown()
+			server.server_close()
+
+	def test_ejection(self):
+		good = self.start_proxy(False)
+		bad = self.start_proxy(True)
+		pool = ProxyPool([good, bad], max_errors=2, eject_time=60)
+		answers = 0
+		for i in range(30):
+			try:
+				data = pool.open('http://clients1.google.it/complete/search?q=come')
+				self.assertTrue(data.startswith(b'window.google.ac.h'))
+				answers += 1
+			except urllib.error.HTTPError as e:
+				self.assertEqual(e.code, 503)
+		self.assertEqual(self.servers[1].hits, 2)
+		self.assertEqual(answers, 28)
+		stats = pool.stats()
+		self.assertTrue(stats[1]['ejected'])
+		self.assertFalse(stats[0]['ejected'])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,316 @@
+# -*- coding: UTF-8 -*-
+'''
+Publishing of the ordered keywords read by webkeywords
+'''
+import unittest
+import time
+
+#_ids of the crawler documents changed since the last publish
+CHANGES = 'crawler_changes'
+#what the published collections have been built from, by name
+META = 'published'
+
+def publish(db, keys, name='orderedkeys', indexes=('index',), batch_size=1000, meta=None):
+	'''
+	Writes keys, any iterable of documents, with their position in the
+	index field to a staging collection in batches of batch_size. Once
+	its indexes are built it is renamed over name, so readers see either
+	the old collection or the new one, never a partial one. If meta is
+	given it is saved as what name has been built from and the changes
+	recorded so far are forgotten.
+	Returns the number of keys.
+	'''
+	started = time.time()
+	staging = db[name + '_staging']
+	staging.drop()
+	count = 0
+	batch = list()
+	for key in keys:
+		key['index'] = count
+		count = count + 1
+		batch.append(key)
+		if len(batch) >= batch_size:
+			staging.insert(batch)
+			batch = list()
+	if batch:
+		staging.insert(batch)
+	if count == 0:
+		db.create_collection(staging.name)
+	for index in indexes:
+		staging.ensure_index(index)
+	staging.rename(name, dropTarget=True)
+	if meta is not None:
+		_published(db, name, meta, count, started)
+	return count
+
+def record_changes(db, ids):
+	'''
+	Remembers that the crawler documents with these _ids changed
+	'''
+	ids = list(ids)
+	if not ids:
+		return
+	now = time.time()
+	#the _ids already there are dropped by the unique index, then touched
+	db[CHANGES].insert([dict(_id=_id, t=now) for _id in ids], continue_on_error=True)
+	db[CHANGES].update({'_id': {'$in': ids}}, {'$set': {'t': now}}, multi=True)
+
+def changed_ids(db):
+	return [doc['_id'] for doc in db[CHANGES].find({}, ['_id'])]
+
+def published(db, name='orderedkeys'):
+	'''
+	The meta of the last publish of name, with its count, None if unknown
+	'''
+	return db[META].find_one(dict(_id=name))
+
+def forget_published(db, name='orderedkeys'):
+	'''
+	The crawler collection is rebuilt: the next publish of name must be a full one
+	'''
+	db[META].remove(dict(_id=name))
+	db[CHANGES].drop()
+
+def _published(db, name, meta, count, started):
+	meta = dict(meta)
+	meta.update(_id=name, count=count, published=started)
+	db[META].save(meta)
+	#the changes made while publishing are left to the next one
+	db[CHANGES].remove({'t': {'$lt': started}})
+
+def patch(db, docs, removed, key, name='orderedkeys', fields=None, meta=None, batch_size=1000, started=None):
+	'''
+	Applies the changes of the crawler documents to the published
+	collection name in place: docs, the current version of the changed
+	documents, are written and the _ids of removed are deleted. key(doc)
+	is the position of a document in the published order and fields the
+	ones it reads. A document staying where it was keeps its index, the
+	others get one between the indexes of their new neighbours, found with
+	a single pass over name in index order.
+	started is when the changes were read, the ones recorded later are
+	kept for the next patch.
+	Returns the number of documents written, None if there was no room
+	left between two indexes: nothing has been written then, the
+	collection needs a full publish.
+	'''
+	if started is None:
+		started = time.time()
+	target = db[name]
+	if fields is not None:
+		fields = list(fields) + ['_id', 'index']
+	docs = sorted(docs, key=key)
+	ids = [doc['_id'] for doc in docs]
+	removed = set(removed) - set(ids)
+	old = dict()
+	for i in range(0, len(ids), batch_size):
+		for doc in target.find({'_id': {'$in': ids[i:i + batch_size]}}, fields):
+			old[doc['_id']] = doc
+	moving = list()
+	for doc in docs:
+		if doc['_id'] in old and key(old[doc['_id']]) == key(doc):
+			doc['index'] = old[doc['_id']]['index']
+		else:
+			moving.append(doc)
+	keys = [key(doc) for doc in moving]
+	skip = removed.union(doc['_id'] for doc in moving)
+	previous = None
+	start = 0
+	if moving:
+		for doc in target.find({}, fields).sort([('index', 1)]).batch_size(batch_size):
+			if doc['_id'] in skip:
+				continue
+			end = start
+			doc_key = key(doc)
+			while end < len(moving) and keys[end] < doc_key:
+				end = end + 1
+			if end > start and not _spread(moving[start:end], previous, doc['index']):
+				return None
+			previous = doc['index']
+			start = end
+			if start == len(moving):
+				break
+		if not _spread(moving[start:], previous, None):
+			return None
+	inserts = [doc for doc in moving if doc['_id'] not in old]
+	for i in range(0, len(inserts), batch_size):
+		target.insert(inserts[i:i + batch_size])
+	for doc in docs:
+		if doc['_id'] in old:
+			target.update({'_id': doc['_id']}, doc)
+	removed = list(removed)
+	for i in range(0, len(removed), batch_size):
+		target.remove({'_id': {'$in': removed[i:i + batch_size]}})
+	if meta is not None:
+		_published(db, name, meta, target.count(), started)
+	return len(docs)
+
+def _spread(docs, low, high):
+	'''
+	Gives docs increasing indexes between low and high, excluded, either
+	may be None. False if they do not fit.
+	'''
+	if not docs:
+		return True
+	n = len(docs)
+	if low is None and high is None:
+		low, high = -1, n
+	elif low is None:
+		low = high - n - 1
+	elif high is None:
+		high = low + n + 1
+	step = (high - low) / float(n + 1)
+	last = low
+	for i, doc in enumerate(docs):
+		doc['index'] = low + step * (i + 1)
+		if not last < doc['index'] < high:
+			return False
+		last = doc['index']
+	return True
+
+class PublishTest(unittest.TestCase):
+
+	class Collection(object):
+		def __init__(self, db, name):
+			self.db = db
+			self.name = name
+			self.docs = list()
+			self.inserts = list()
+			self.indexes = list()
+		def drop(self):
+			self.db.collections.pop(self.name, None)
+		def insert(self, docs):
+			self.db.collections[self.name] = self
+			self.inserts.append(len(docs))
+			self.docs.extend(docs)
+		def ensure_index(self, index):
+			self.indexes.append(index)
+		def rename(self, name, dropTarget=False):
+			self.db.events.append(('rename', self.name, name, list(self.indexes)))
+			self.db.collections[name] = self.db.collections.pop(self.name)
+			self.name = name
+
+	class Db(object):
+		def __init__(self):
+			self.collections = dict()
+			self.events = list()
+		def __getitem__(self, name):
+			return self.collections.get(name) or PublishTest.Collection(self, name)
+		def create_collection(self, name):
+			self.collections[name] = PublishTest.Collection(self, name)
+
+	def test_publish(self):
+		db = self.Db()
+		old = db['orderedkeys']
+		old.insert([dict(keyword='old')])
+		keys = (dict(keyword='come %s' % i) for i in range(2500))
+		self.assertEqual(publish(db, keys, indexes=('index', 'parent')), 2500)
+		published = db['orderedkeys']
+		self.assertEqual(published.inserts, [1000, 1000, 500])
+		self.assertEqual([key['index'] for key in published.docs], list(range(2500)))
+		self.assertEqual(db.events, [('rename', 'orderedkeys_staging', 'orderedkeys', ['index', 'parent'])])
+		self.assertEqual(sorted(db.collections), ['orderedkeys'])
+		self.assertEqual(publish(db, iter([])), 0)
+		self.assertEqual(db['orderedkeys'].docs, [])
+
+class PatchTest(unittest.TestCase):
+
+	class Cursor(object):
+		def __init__(self, docs):
+			self.docs = docs
+		def sort(self, order):
+			self.docs.sort(key=lambda doc: doc[order[0][0]])
+			return self
+		def batch_size(self, n):
+			return self
+		def __iter__(self):
+			return iter(self.docs)
+
+	class Collection(object):
+		def __init__(self):
+			self.docs = dict()
+			self.writes = 0
+		def find(self, spec=None, fields=None):
+			ids = (spec or {}).get('_id', {}).get('$in')
+			docs = [doc for _id, doc in self.docs.items() if ids is None or _id in ids]
+			return PatchTest.Cursor([dict((field, doc[field]) for field in fields) if fields else dict(doc) for doc in docs])
+		def insert(self, docs, continue_on_error=False):
+			self.writes = self.writes + len(docs)
+			for doc in docs:
+				if not continue_on_error or doc['_id'] not in self.docs:
+					self.docs[doc['_id']] = dict(doc)
+		def update(self, spec, doc, multi=False):
+			self.writes = self.writes + 1
+			if multi:
+				for _id in spec['_id']['$in']:
+					self.docs[_id].update(doc['$set'])
+			else:
+				self.docs[spec['_id']] = dict(doc)
+		def save(self, doc):
+			self.docs[doc['_id']] = dict(doc)
+		def find_one(self, spec):
+			return self.docs.get(spec['_id'])
+		def remove(self, spec):
+			if 't' in spec:
+				for _id in [_id for _id, doc in self.docs.items() if doc['t'] < spec['t']['$lt']]:
+					del self.docs[_id]
+				return
+			for _id in spec['_id']['$in']:
+				if self.docs.pop(_id, None) is not None:
+					self.writes = self.writes + 1
+		def count(self):
+			return len(self.docs)
+
+	class Db(object):
+		def __init__(self):
+			self.collections = dict()
+			self.orderedkeys = self['orderedkeys']
+		def __getitem__(self, name):
+			return self.collections.setdefault(name, PatchTest.Collection())
+
+	def ordered(self, db):
+		return [doc['_id'] for doc in sorted(db.orderedkeys.docs.values(), key=lambda doc: doc['index'])]
+
+	def test_patch(self):
+		key = lambda doc: (doc['group'], doc['_id'])
+		crawl = dict((i, dict(_id=i, group=i % 7, has_child=False)) for i in range(100))
+		db = self.Db()
+		db.orderedkeys.insert([dict(doc, index=n) for n, doc in enumerate(sorted(crawl.values(), key=key))])
+		db.orderedkeys.writes = 0
+		before = dict((_id, doc['index']) for _id, doc in db.orderedkeys.docs.items())
+		changed = [dict(_id=i, group=i % 9, has_child=False) for i in range(100, 130)]
+		changed.extend([dict(_id=-1, group=-1), dict(_id=200, group=10)])
+		changed.extend(dict(crawl[i], has_child=True) for i in range(0, 100, 10))
+		changed.extend(dict(crawl[i], group=3) for i in range(1, 100, 10))
+		removed = list(range(5, 100, 10)) + [1000]
+		self.assertEqual(patch(db, changed, removed, key, fields=['group']), len(changed))
+		for doc in changed:
+			crawl[doc['_id']] = doc
+		for _id in removed:
+			crawl.pop(_id, None)
+		self.assertEqual(self.ordered(db), [doc['_id'] for doc in sorted(crawl.values(), key=key)])
+		for i in range(0, 100, 10):
+			self.assertEqual(db.orderedkeys.docs[i]['index'], before[i])
+			self.assertTrue(db.orderedkeys.docs[i]['has_child'])
+		self.assertEqual(db.orderedkeys.docs[12]['index'], before[12])
+		self.assertEqual(db.orderedkeys.writes, len(changed) + len(removed) - 1)
+
+	def test_changes_while_patching(self):
+		db = self.Db()
+		db.orderedkeys.insert([dict(_id=0, index=0)])
+		record_changes(db, [1])
+		started = time.time()
+		ids = changed_ids(db)
+		time.sleep(0.01)
+		record_changes(db, [2])
+		self.assertEqual(patch(db, [dict(_id=_id) for _id in ids], [], lambda doc: doc['_id'], fields=[], meta=dict(order='test'), started=started), 1)
+		self.assertEqual(changed_ids(db), [2])
+		self.assertEqual(published(db)['count'], 2)
+
+	def test_no_room(self):
+		db = self.Db()
+		db.orderedkeys.insert([dict(_id=0, index=1.0), dict(_id=2, index=1.0 + 2 ** -52)])
+		self.assertEqual(patch(db, [dict(_id=1)], [], lambda doc: doc['_id'], fields=[]), None)
+		self.assertEqual(sorted(db.orderedkeys.docs), [0, 2])
+
+if __name__ == '__main__':
+	unittest.main()
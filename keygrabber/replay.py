@@ -0,0 +1,193 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+'''
+Local stand-in of the Google Instant endpoint: it replays recorded answers
+so that crawls can be benchmarked and compared without the network
+'''
+import unittest
+import os
+import json
+import time
+import random
+import bisect
+import heapq
+import tempfile
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+from google import Google
+from throttle import Throttle
+from suggest_parser import SAMPLES, parse_suggest
+
+class Recorder(object):
+	'''
+	Appends the raw answers of Google to a jsonl file with the format of
+	data/suggest_samples.jsonl. A payload of null is a 400 answer.
+	'''
+	def __init__(self, path, encoding='iso-8859-15'):
+		self.encoding = encoding
+		self.lock = threading.Lock()
+		self.f = open(path, 'a', encoding='utf-8')
+
+	def record(self, term, data):
+		payload = data.decode(self.encoding) if data is not None else None
+		line = json.dumps(dict(term=term, payload=payload)) + '\n'
+		with self.lock:
+			self.f.write(line)
+			self.f.flush()
+
+	def close(self):
+		self.f.close()
+
+def load_recording(path=SAMPLES, encoding='iso-8859-15'):
+	'''
+	Returns {term: raw answer or None for a 400}, the last answer of a term wins
+	'''
+	answers = dict()
+	with open(path, encoding='utf-8') as f:
+		for line in f:
+			if line.strip():
+				item = json.loads(line)
+				payload = item['payload']
+				answers[item['term']] = payload.encode(encoding, 'xmlcharrefreplace') if payload is not None else None
+	return answers
+
+def make_answer(term, suggestions):
+	'''
+	Raw answer of google instant, with the completion in bold
+	'''
+	entries = [[s[:len(term)] + '<b>' + s[len(term):] + '</b>' if s.startswith(term) else s, 0, str(n)] for n, s in enumerate(suggestions)]
+	return ('window.google.ac.h(%s)' % json.dumps([term, entries, {'q': 'x', 'k': 1}])).encode('iso-8859-15', 'xmlcharrefreplace')
+
+class SyntheticSuggest(object):
+	'''
+	Deterministic google instant over size generated keywords starting with
+	base: a term is answered with the max_answers most popular keywords
+	starting with it. Words are drawn with a long tail from a vocabulary,
+	so the keywords share prefixes the way real searches do.
+	'''
+	def __init__(self, base='come', size=5000, seed=0, vocabulary=500, max_answers=10):
+		rnd = random.Random(seed)
+		letters = 'aaabcccddeeeeffgghiiiilllmmnnnoooopprrrssssttttuuvz'
+		words = list()
+		while len(words) < vocabulary:
+			word = ''.join(rnd.choice(letters) for i in range(rnd.randint(2, 9)))
+			if word not in words:
+				words.append(word)
+		keywords = set()
+		while len(keywords) < size:
+			phrase = [words[int(rnd.paretovariate(1.0)) % len(words)] for i in range(rnd.randint(1, 4))]
+			keywords.add(base + ' ' + ' '.join(phrase))
+		self.keywords = sorted(keywords)
+		self.popularity = [rnd.random() for keyword in self.keywords]
+		self.max_answers = max_answers
+		self.cache = dict()
+
+	def suggest(self, term):
+		suggestions = self.cache.get(term)
+		if suggestions is None:
+			start = bisect.bisect_left(self.keywords, term)
+			end = bisect.bisect_left(self.keywords, term + '\uffff')
+			best = heapq.nsmallest(self.max_answers, range(start, end), key=lambda i: self.popularity[i])
+			suggestions = self.cache[term] = [self.keywords[i] for i in best]
+		return suggestions
+
+	def __call__(self, term):
+		return make_answer(term, self.suggest(term))
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+
+class ReplayServer(object):
+	'''
+	Answers the suggest requests of Google with the recorded answers, then
+	with fallback(term) if given, else with an empty answer. Every request
+	waits latency seconds plus a random jitter. It can be used as the url
+	of Google or as its proxy.
+	'''
+	def __init__(self, answers=None, fallback=None, latency=0.0, jitter=0.0, host='127.0.0.1', port=0):
+		self.answers = answers if answers is not None else dict()
+		self.fallback = fallback
+		self.latency = latency
+		self.jitter = jitter
+		self.requests = 0
+		self.misses = 0
+		self.lock = threading.Lock()
+		replay = self
+		class Handler(BaseHTTPRequestHandler):
+			protocol_version = 'HTTP/1.1'
+			def do_GET(self):
+				term = parse_qs(urlsplit(self.path).query).get('q', [''])[0]
+				status, body = replay.answer(term)
+				self.send_response(status)
+				self.send_header('Content-Type', 'text/javascript; charset=ISO-8859-1')
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+			def log_message(self, *args):
+				pass
+		self.server = ThreadingHTTPServer((host, port), Handler)
+		self.url = 'http://%s:%s/complete/search' % (host, self.server.server_port)
+		self.thread = None
+
+	def answer(self, term):
+		'''
+		Returns (http status, body) for term
+		'''
+		delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+		if delay:
+			time.sleep(delay)
+		with self.lock:
+			self.requests = self.requests + 1
+		if term in self.answers:
+			data = self.answers[term]
+			return (400, b'') if data is None else (200, data)
+		if self.fallback is not None:
+			return 200, self.fallback(term)
+		with self.lock:
+			self.misses = self.misses + 1
+		return 200, make_answer(term, [])
+
+	def start(self):
+		self.thread = threading.Thread(target=self.server.serve_forever)
+		self.thread.daemon = True
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+class ReplayTest(unittest.TestCase):
+
+	def test_record_replay(self):
+		synthetic = SyntheticSuggest(size=500, seed=1)
+		live = ReplayServer(fallback=synthetic).start()
+		path = os.path.join(tempfile.mkdtemp(), 'recording.jsonl')
+		recorder = Recorder(path)
+		google = Google(url=live.url, recorder=recorder, throttle=Throttle(rate=1000, max_rate=1000, burst=100, report_every=0))
+		expected = [google.search(term) for term in ('come ', 'come a', 'come zzz')]
+		expanded = list(google.expand('come'))
+		recorder.close()
+		live.stop()
+		self.assertEqual(len(expected[0]), 10)
+		self.assertEqual(expected[0], [s for s in synthetic.suggest('come ') if s != 'come '])
+		self.assertEqual(expected[2], [])
+		replay = ReplayServer(load_recording(path), latency=0.01).start()
+		google = Google(proxy={'http': replay.url[len('http://'):].split('/')[0]}, throttle=Throttle(rate=1000, max_rate=1000, burst=100, report_every=0))
+		start = time.time()
+		self.assertEqual([google.search(term) for term in ('come ', 'come a', 'come zzz')], expected)
+		self.assertTrue(time.time() - start >= 0.03)
+		self.assertEqual(list(google.expand('come')), expanded)
+		self.assertEqual(replay.misses, 0)
+		replay.stop()
+
+	def test_samples(self):
+		answers = load_recording()
+		self.assertEqual(parse_suggest(answers['come q']), ['come quando fuori piove'])
+		self.assertEqual(parse_suggest(make_answer('come ', ["come l'arte"])), ["come l'arte"])
+
+if __name__ == '__main__':
+	unittest.main()
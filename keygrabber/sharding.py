@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+'''
+Coordination of the worker processes of a sharded crawl
+'''
+import unittest
+import time
+import pymongo
+from string import ascii_lowercase
+
+def shard_of(keyword, base, shards):
+	'''
+	Worker owning keyword: it depends on the first letter following base, so
+	a root and every keyword starting with it belong to the same worker
+	'''
+	suffix = keyword[len(base):].strip()
+	if not suffix:
+		return 0
+	return ord(suffix[0]) % shards
+
+class ShardInbox(object):
+	'''
+	Roots a worker finds for the dictionaries of another one are posted to
+	crawler_inbox, crawler_shards tells which workers ran out of roots. The
+	crawl is over when all of them did and nothing is waiting in an inbox.
+	Items are acknowledged once they are in a checkpoint of their worker.
+	'''
+	def __init__(self, db, shard=None, poll=5.0):
+		self.shard, self.shards = shard if shard is not None else (None, 1)
+		self.poll = poll
+		self.items = db.crawler_inbox
+		self.status = db.crawler_shards
+		self.items.ensure_index([('shard', pymongo.ASCENDING), ('taken', pymongo.ASCENDING)])
+
+	def clear(self):
+		self.items.remove()
+		self.status.remove()
+
+	def reset(self):
+		self.status.remove()
+
+	def post(self, shard, doc):
+		self.items.insert(dict(shard=shard, taken=False, key=doc))
+
+	def take(self):
+		'''
+		Returns the items waiting for this worker, which is not idle anymore
+		'''
+		items = list(self.items.find({'shard': self.shard, 'taken': False}))
+		if items:
+			self.set_idle(False)
+		return items
+
+	def ack(self, items):
+		if items:
+			self.items.update({'_id': {'$in': [item['_id'] for item in items]}}, {'$set': {'taken': True}}, multi=True)
+
+	def set_idle(self, idle):
+		self.status.save(dict(_id=self.shard, idle=idle))
+
+	def finished(self):
+		if self.status.find({'idle': True}).count() < self.shards:
+			return False
+		return self.items.find({'taken': False}).count() == 0
+
+	def wait(self):
+		'''
+		Returns the items for this worker as soon as there are some, or an
+		empty list when the crawl is over
+		'''
+		while True:
+			items = self.take()
+			if items:
+				return items
+			self.set_idle(True)
+			if self.finished():
+				return []
+			time.sleep(self.poll)
+
+class ShardOfTest(unittest.TestCase):
+
+	def test_partition(self):
+		owners = [shard_of('come ' + c, 'come', 3) for c in ascii_lowercase]
+		self.assertEqual(sorted(set(owners)), [0, 1, 2])
+		self.assertEqual(shard_of('come', 'come', 3), 0)
+		self.assertEqual(shard_of('come ', 'come', 3), 0)
+		for keyword in ['come fare', 'come fare il pane', 'come fa', 'come f']:
+			self.assertEqual(shard_of(keyword, 'come', 3), shard_of('come f', 'come', 3))
+
+if __name__ == '__main__':
+	unittest.main()
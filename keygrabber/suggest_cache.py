@@ -0,0 +1,127 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+'''
+Persistent cache for Google Instant answers, stored in a sqlite file so it
+survives between crawls. Entries are keyed by (term, hl, client), expire
+after `ttl` seconds and the least recently used ones are evicted once the
+cache holds more than `size` entries. Several processes can share the
+file: the last use of the entries is written in batches of `used_batch`,
+so reads never hold its write lock.
+'''
+import unittest
+import sqlite3
+import threading
+import json
+import time
+import os
+import tempfile
+
+class SuggestCache(object):
+	def __init__(self, path, ttl=30*24*3600, size=5000000, used_batch=100, timeout=30.0):
+		self.path = path
+		self.ttl = ttl
+		self.size = size
+		self.used_batch = used_batch
+		self.hits = 0
+		self.misses = 0
+		#(term, hl, client): last use not written yet
+		self.used = dict()
+		self.lock = threading.Lock()
+		#timeout: seconds to wait for the write lock of another process
+		self.db = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+		self.db.execute('PRAGMA journal_mode=WAL')
+		self.db.execute('CREATE TABLE IF NOT EXISTS suggest (term TEXT, hl TEXT, client TEXT, answer TEXT, created REAL, used REAL, PRIMARY KEY (term, hl, client))')
+		self.db.execute('CREATE INDEX IF NOT EXISTS suggest_used ON suggest (used)')
+		self.db.commit()
+		self.count = self.db.execute('SELECT COUNT(*) FROM suggest').fetchone()[0]
+
+	def get(self, term, hl, client):
+		'''
+		Returns the cached answer or None
+		'''
+		now = time.time()
+		with self.lock:
+			row = self.db.execute('SELECT answer, created FROM suggest WHERE term=? AND hl=? AND client=?', (term, hl, client)).fetchone()
+			if row is None or now - row[1] > self.ttl:
+				self.misses += 1
+				return None
+			self.used[(term, hl, client)] = now
+			if len(self.used) >= self.used_batch:
+				self._write_used()
+				self.db.commit()
+			self.hits += 1
+		return json.loads(row[0])
+
+	def set(self, term, hl, client, answer):
+		now = time.time()
+		with self.lock:
+			self._write_used()
+			cursor = self.db.execute('INSERT OR REPLACE INTO suggest VALUES (?, ?, ?, ?, ?, ?)', (term, hl, client, json.dumps(answer), now, now))
+			self.count = self.count + 1
+			if self.count > self.size:
+				self.db.execute('DELETE FROM suggest WHERE created < ?', (now - self.ttl,))
+				self.db.execute('DELETE FROM suggest WHERE rowid IN (SELECT rowid FROM suggest ORDER BY used LIMIT ?)', (max(self.count - self.size, 0),))
+				self.count = self.db.execute('SELECT COUNT(*) FROM suggest').fetchone()[0]
+			self.db.commit()
+
+	def _write_used(self):
+		if self.used:
+			self.db.executemany('UPDATE suggest SET used=? WHERE term=? AND hl=? AND client=?', [(used,) + key for key, used in self.used.items()])
+			self.used = dict()
+
+	def stats(self):
+		total = self.hits + self.misses
+		return dict(hits=self.hits, misses=self.misses, entries=self.count, hit_rate=float(self.hits) / total if total else 0.0)
+
+	def close(self):
+		with self.lock:
+			self._write_used()
+			self.db.commit()
+			self.db.close()
+
+class SuggestCacheTest(unittest.TestCase):
+
+	def setUp(self):
+		fd, self.path = tempfile.mkstemp(suffix='.sqlite')
+		os.close(fd)
+
+	def tearDown(self):
+		os.remove(self.path)
+
+	def test_persistence(self):
+		cache = SuggestCache(self.path)
+		self.assertEqual(cache.get('come ', 'it', 'hp'), None)
+		cache.set('come ', 'it', 'hp', ['come fare', 'come stai'])
+		cache.close()
+		cache = SuggestCache(self.path)
+		self.assertEqual(cache.get('come ', 'it', 'hp'), ['come fare', 'come stai'])
+		self.assertEqual(cache.get('come ', 'en', 'hp'), None)
+		self.assertEqual(cache.stats()['hits'], 1)
+		self.assertEqual(cache.stats()['misses'], 1)
+
+	def test_ttl_and_size(self):
+		cache = SuggestCache(self.path, ttl=0)
+		cache.set('come', 'it', 'hp', [])
+		time.sleep(0.01)
+		self.assertEqual(cache.get('come', 'it', 'hp'), None)
+		cache = SuggestCache(self.path, size=2)
+		for term in ('a', 'b', 'c'):
+			cache.set(term, 'it', 'hp', [term])
+		self.assertEqual(cache.stats()['entries'], 2)
+		self.assertEqual(cache.get('a', 'it', 'hp'), None)
+
+	def test_shared_file(self):
+		a = SuggestCache(self.path, used_batch=1, timeout=0.1)
+		b = SuggestCache(self.path, timeout=0.1)
+		a.set('come', 'it', 'hp', ['come fare'])
+		for i in range(3):
+			self.assertEqual(a.get('come', 'it', 'hp'), ['come fare'])
+			self.assertEqual(b.get('come', 'it', 'hp'), ['come fare'])
+			#no lock is left behind by the reads
+			b.set('come %s' % i, 'it', 'hp', [])
+			a.set('dove %s' % i, 'it', 'hp', [])
+		a.close()
+		b.close()
+
+if __name__ == '__main__':
+	unittest.main()
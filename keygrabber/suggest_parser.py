@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+'''
+Parser of the Google Instant answers:
+window.google.ac.h(["term",[["sugg<b>estion</b>",0,"0"],...],{...}])
+'''
+import unittest
+import os
+import json
+import re
+from html import unescape
+
+PREFIX = b'window.google.ac.h('
+#matches the <b> highlighting of the suggestions
+HTML_TAG = re.compile('</?b>')
+SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'suggest_samples.jsonl')
+
+def parse_suggest(data, encoding='iso-8859-15'):
+	'''
+	Returns the suggestions of a raw answer or None if it is not a valid one
+	'''
+	if not data.startswith(PREFIX):
+		return None
+	body = data[len(PREFIX):].rstrip()
+	if not body.endswith(b')'):
+		return None
+	try:
+		entries = json.loads(body[:-1].decode(encoding))[1]
+		suggestions = list()
+		for entry in entries:
+			text = entry[0]
+			if '<' in text:
+				text = HTML_TAG.sub('', text)
+			if '&' in text:
+				text = unescape(text)
+			suggestions.append(text)
+	except (ValueError, IndexError, TypeError, KeyError):
+		return None
+	return suggestions
+
+def load_samples(path=SAMPLES, encoding='iso-8859-15'):
+	'''
+	Returns [(term, raw answer)] of a recording
+	'''
+	samples = list()
+	with open(path, encoding='utf-8') as f:
+		for line in f:
+			if line.strip():
+				item = json.loads(line)
+				samples.append((item['term'], item['payload'].encode(encoding, 'xmlcharrefreplace')))
+	return samples
+
+class SuggestParserTest(unittest.TestCase):
+
+	def legacy_parse(self, data):
+		'''
+		what Google.getInstantKeys used to do
+		'''
+		data = data.decode('iso-8859-15')
+		if data[0:18] != 'window.google.ac.h':
+			return None
+		try:
+			g_list = json.loads(data[19:-1])
+		except:
+			return None
+		return [unescape(re.compile('<\\/*b>').sub('', entry[0])) for entry in g_list[1]]
+
+	def test_samples(self):
+		for term, data in load_samples():
+			self.assertEqual(parse_suggest(data), self.legacy_parse(data))
+
+	def test_malformed(self):
+		for data in [b'', b'<html>sorry</html>', b'window.google.ac.h(["come",[["come', b'window.google.ac.h(["come"])', b'window.google.ac.h([1, 2])']:
+			self.assertEqual(parse_suggest(data), None)
+		self.assertEqual(parse_suggest(b'window.google.ac.h(["come",[["come<b> l&#39;arte</b>",0]],{}])\n'), ["come l'arte"])
+
+if __name__ == '__main__':
+	unittest.main()
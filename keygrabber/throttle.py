@@ -0,0 +1,121 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+'''
+Adaptive rate limiter for the Google Instant requests
+'''
+import unittest
+import threading
+import random
+import time
+from collections import deque
+import logging
+
+log = logging.getLogger('google')
+
+class Throttle(object):
+	'''
+	Token bucket shared by all the threads of a Google client. The refill
+	rate adapts to the answers: it grows by `step` after every fast success,
+	it shrinks when requests get slower than `slow` seconds and it is halved
+	on errors. Every error also blocks the bucket for an exponential backoff
+	with jitter, doubled at every consecutive failure up to max_delay.
+	'''
+	def __init__(self, rate=5.0, min_rate=0.1, max_rate=50.0, burst=5, step=0.05, slow=2.0, base_delay=1.0, max_delay=300.0, report_every=1000):
+		self.lock = threading.Lock()
+		self.rate = float(rate)
+		self.min_rate = min_rate
+		self.max_rate = max_rate
+		self.burst = burst
+		self.step = step
+		self.slow = slow
+		self.base_delay = base_delay
+		self.max_delay = max_delay
+		self.report_every = report_every
+		self.tokens = float(burst)
+		self.updated = time.time()
+		self.blocked_until = 0
+		self.failures = 0
+		self.requests = 0
+		self.retries = 0
+		self.errors = dict()
+		self.latency = None
+		self.recent = deque()
+
+	def _refill(self, now):
+		self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	def acquire(self):
+		'''
+		Blocks until a request can be sent
+		'''
+		while True:
+			with self.lock:
+				now = time.time()
+				self._refill(now)
+				wait = self.blocked_until - now
+				if wait <= 0:
+					if self.tokens >= 1:
+						self.tokens = self.tokens - 1
+						self.requests = self.requests + 1
+						self.recent.append(now)
+						while self.recent and self.recent[0] < now - 60:
+							self.recent.popleft()
+						if self.report_every and self.requests % self.report_every == 0:
+							log.info('throttle: %s', self.stats())
+						return
+					wait = (1 - self.tokens) / self.rate
+			time.sleep(wait)
+
+	def success(self, latency):
+		with self.lock:
+			self.failures = 0
+			self.latency = latency if self.latency is None else 0.9 * self.latency + 0.1 * latency
+			if latency > self.slow:
+				self.rate = max(self.min_rate, self.rate * 0.9)
+			else:
+				self.rate = min(self.max_rate, self.rate + self.step)
+
+	def failure(self, code=None):
+		'''
+		Records a failed request, returns the seconds to wait before retrying
+		'''
+		with self.lock:
+			self.failures = self.failures + 1
+			self.retries = self.retries + 1
+			self.errors[str(code)] = self.errors.get(str(code), 0) + 1
+			self.rate = max(self.min_rate, self.rate / 2)
+			delay = min(self.max_delay, self.base_delay * 2 ** (self.failures - 1))
+			delay = random.uniform(delay / 2, delay)
+			self.blocked_until = max(self.blocked_until, time.time() + delay)
+		log.warning('google request failed (%s), retrying in %.1fs: %s', code, delay, self.stats())
+		return delay
+
+	def stats(self):
+		now = time.time()
+		recent = [t for t in list(self.recent) if t >= now - 60]
+		return dict(rate=round(self.rate, 2), requests=self.requests, retries=self.retries, errors=dict(self.errors), consecutive_failures=self.failures, latency=round(self.latency, 3) if self.latency is not None else None, requests_per_sec=round(len(recent) / 60.0, 2))
+
+class ThrottleTest(unittest.TestCase):
+
+	def test_rate(self):
+		t = Throttle(rate=100, burst=1, report_every=0)
+		start = time.time()
+		for i in range(11):
+			t.acquire()
+		self.assertTrue(time.time() - start >= 0.09)
+		self.assertEqual(t.stats()['requests'], 11)
+
+	def test_backoff(self):
+		t = Throttle(rate=8, base_delay=0.01, max_delay=0.04, report_every=0)
+		delays = [t.failure(503) for i in range(4)]
+		self.assertEqual(t.rate, 0.5)
+		self.assertTrue(0.005 <= delays[0] <= 0.01)
+		self.assertTrue(0.02 <= delays[3] <= 0.04)
+		self.assertEqual(t.stats()['errors'], {'503': 4})
+		t.success(0.1)
+		self.assertEqual(t.failures, 0)
+		self.assertTrue(t.rate > 0.5)
+
+if __name__ == '__main__':
+	unittest.main()
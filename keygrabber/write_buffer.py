@@ -0,0 +1,150 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+'''
+Write-behind buffer for the crawler collection
+'''
+import unittest
+import time
+from bson.objectid import ObjectId
+
+class WriteBuffer(object):
+	'''
+	Documents are given their _id on insert() and sent to Mongo in bulk,
+	has_child flips are merged into a single update. The buffer is flushed
+	when it holds size documents, due() tells when interval seconds passed
+	since the last flush. changes, if given, is called with the _ids of
+	the documents every flush writes.
+	When shared, other writers insert into the collection too and the
+	unique index on keyword drops the second insert of a keyword: after
+	every flush the _ids of the dropped documents are aliases of the
+	stored ones and rejected(keyword, _id) is called with the stored _id.
+	'''
+	def __init__(self, collection, size=1000, interval=5.0, changes=None, shared=False, rejected=None):
+		self.collection = collection
+		self.changes = changes
+		self.shared = shared
+		self.rejected = rejected
+		#_id given to a dropped insert: _id of the stored document
+		self.aliases = dict()
+		self.size = size
+		self.interval = interval
+		self.docs = list()
+		self.buffered = dict()
+		self.has_child = set()
+		self.last_flush = time.time()
+		#requests sent to mongo
+		self.ops = 0
+
+	def insert(self, doc):
+		if doc.get('_id') is None:
+			doc['_id'] = ObjectId()
+		self.docs.append(doc)
+		self.buffered[doc['_id']] = doc
+		if len(self.docs) >= self.size:
+			self.flush()
+		return doc['_id']
+
+	def set_has_child(self, _id):
+		_id = self.aliases.get(_id, _id)
+		doc = self.buffered.get(_id)
+		if doc is not None:
+			doc['has_child'] = True
+		else:
+			self.has_child.add(_id)
+
+	def due(self):
+		return time.time() - self.last_flush >= self.interval or len(self.docs) + len(self.has_child) >= self.size
+
+	def flush(self):
+		if self.docs:
+			#a duplicate keyword of another worker is dropped by the unique index
+			self.collection.insert(self.docs, continue_on_error=True)
+			self.ops = self.ops + 1
+			if self.shared:
+				self.__resolve()
+		has_child = list(set(self.aliases.get(_id, _id) for _id in self.has_child))
+		if has_child:
+			self.collection.update({'_id': {'$in': has_child}}, {'$set': {'has_child': True}}, multi=True)
+			self.ops = self.ops + 1
+		if self.changes is not None and (self.docs or has_child):
+			self.changes([self.aliases.get(doc['_id'], doc['_id']) for doc in self.docs] + has_child)
+		self.clear()
+
+	def __resolve(self):
+		'''
+		Finds the documents of the last insert another writer stored first
+		'''
+		stored = dict()
+		for doc in self.collection.find({'keyword': {'$in': [doc['keyword'] for doc in self.docs]}}, ['keyword']):
+			stored[doc['keyword']] = doc['_id']
+		self.ops = self.ops + 1
+		for doc in self.docs:
+			_id = stored.get(doc['keyword'])
+			if _id is None or _id == doc['_id']:
+				continue
+			self.aliases[doc['_id']] = _id
+			if doc.get('has_child'):
+				self.has_child.add(_id)
+			if self.rejected is not None:
+				self.rejected(doc['keyword'], _id)
+
+	def clear(self):
+		self.docs = list()
+		self.buffered = dict()
+		self.has_child = set()
+		self.last_flush = time.time()
+
+	def __len__(self):
+		return len(self.docs)
+
+class WriteBufferTest(unittest.TestCase):
+
+	class Collection(object):
+		def __init__(self):
+			self.inserts = list()
+			self.updates = list()
+		def insert(self, docs, continue_on_error=False):
+			self.inserts.append(list(docs))
+		def update(self, spec, document, multi=False):
+			self.updates.append(spec['_id']['$in'])
+		def find(self, spec, fields=None):
+			#come fare was stored by another writer
+			return [dict(keyword=keyword, _id='other' if keyword == 'come fare' else [doc['_id'] for doc in self.inserts[-1] if doc['keyword'] == keyword][0]) for keyword in spec['keyword']['$in']]
+
+	def test_batches(self):
+		c = self.Collection()
+		changes = list()
+		w = WriteBuffer(c, size=3, interval=3600, changes=changes.append)
+		a = w.insert(dict(keyword='come'))
+		w.insert(dict(keyword='come fare'))
+		w.set_has_child(a)
+		self.assertEqual(c.inserts, [])
+		self.assertFalse(w.due())
+		w.insert(dict(keyword='come stai'))
+		self.assertEqual(len(c.inserts), 1)
+		self.assertEqual(c.inserts[0][0]['has_child'], True)
+		self.assertEqual(c.updates, [])
+		w.set_has_child(a)
+		w.flush()
+		self.assertEqual(c.updates, [[a]])
+		self.assertEqual(len(c.inserts), 1)
+		self.assertEqual(changes, [[doc['_id'] for doc in c.inserts[0]], [a]])
+
+	def test_shared(self):
+		c = self.Collection()
+		rejected = list()
+		changes = list()
+		w = WriteBuffer(c, size=10, interval=3600, changes=changes.append, shared=True, rejected=lambda keyword, _id: rejected.append((keyword, _id)))
+		w.insert(dict(keyword='come'))
+		ghost = w.insert(dict(keyword='come fare'))
+		w.set_has_child(ghost)
+		w.flush()
+		self.assertEqual(rejected, [('come fare', 'other')])
+		self.assertEqual(c.updates, [['other']])
+		self.assertTrue('other' in changes[0] and ghost not in changes[0])
+		w.set_has_child(ghost)
+		w.flush()
+		self.assertEqual(c.updates[-1], ['other'])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -14,3 +14,82 @@ class ViewTests(unittest.TestCase):
         request = testing.DummyRequest()
         info = my_view(request)
         self.assertEqual(info['project'], 'webkeywords')
+
+class FakeCursor(object):
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, order):
+        for field, direction in reversed(order):
+            #null is the lowest
+            self.docs.sort(key=lambda doc: (doc.get(field) is not None, doc.get(field)), reverse=direction < 0)
+        return self
+
+    def skip(self, n):
+        self.docs = self.docs[n:]
+        return self
+
+    def limit(self, n):
+        self.docs = self.docs[:n]
+        return self
+
+    def __iter__(self):
+        return iter(self.docs)
+
+class FakeCollection(object):
+    def __init__(self, docs):
+        self.docs = docs
+
+    def match(self, doc, spec):
+        for field, value in spec.items():
+            if field == '$and':
+                if not all(self.match(doc, s) for s in value):
+                    return False
+            elif field == '$or':
+                if not any(self.match(doc, s) for s in value):
+                    return False
+            elif isinstance(value, dict):
+                found = doc.get(field)
+                for op, v in value.items():
+                    if op == '$ne' and found == v:
+                        return False
+                    #nulls are not compared to numbers
+                    if op in ('$lt', '$gt') and (found is None or v is None):
+                        return False
+                    if op == '$lt' and not found < v:
+                        return False
+                    if op == '$gt' and not found > v:
+                        return False
+            elif doc.get(field) != value:
+                return False
+        return True
+
+    def find(self, spec=None, fields=None):
+        return FakeCursor([doc for doc in self.docs if self.match(doc, spec or {})])
+
+class PageTests(unittest.TestCase):
+
+    def test_keyset(self):
+        from bson.objectid import ObjectId
+        from webkeywords.views import _page, _position
+        docs = [dict(_id=ObjectId(), index=i * 0.5, global_searches=[None, 10, 100][i % 3]) for i in range(100)]
+        collection = FakeCollection(docs)
+        for sort, order in (('google instant', [('index', 1)]), ('google adwords', [('global_searches', -1), ('_id', -1)])):
+            expected = list(FakeCollection(list(docs)).find().sort(order))
+            forward = list()
+            page = _page(collection, {}, None, sort, 7, 0, len(docs))
+            while page:
+                forward.extend(page)
+                page = _page(collection, {}, None, sort, 7, after=_position(page[-1], sort))
+            self.assertEqual(forward, expected)
+            backward = list()
+            page = _page(collection, {}, None, sort, 7, before=_position(expected[-1], sort))
+            while page:
+                backward[:0] = page
+                page = _page(collection, {}, None, sort, 7, before=_position(page[0], sort))
+            self.assertEqual(backward, expected[:-1])
+            #numbered pages, from the nearest end
+            self.assertEqual(_page(collection, {}, None, sort, 7, 91, len(docs)), expected[91:98])
+            self.assertEqual(_page(collection, {}, None, sort, 7, 14, len(docs)), expected[14:21])
+            self.assertEqual(_page(collection, {}, None, sort, 7, after=_position(expected[6], sort), skip=7), expected[14:21])
+            self.assertEqual(_page(collection, {}, None, sort, 7, before=_position(expected[21], sort), skip=7), expected[7:14])
@@ -2,11 +2,14 @@ from pyramid.view import view_config
 from pyramid.renderers import get_renderer
 from pyramid.response import Response
 import re
+import os
 import codecs
+import time
 from collections import deque
 from resources import *
 from math import ceil
 import pymongo
+from bson.objectid import ObjectId
 from mongoalchemy.session import Session
 from pyramid.security import authenticated_userid, has_permission
 	
@@ -49,17 +52,49 @@ def admin(request):
 	
 	return dict(message=message)
 
+def _log_files(ufile):
+	'''
+	A log and its rotated files, newest first
+	'''
+	files = [ufile] if os.path.exists(ufile) else []
+	i = 1
+	while os.path.exists('%s.%s' % (ufile, i)):
+		files.append('%s.%s' % (ufile, i))
+		i = i + 1
+	return files
+
+def _log_lines(ufile, last=None):
+	'''
+	Lines of a log across its rotations, only the last ones if given
+	'''
+	data = deque()
+	for name in _log_files(ufile):
+		with codecs.open(name, "r", "utf-8") as f:
+			if last:
+				lines = deque(f, last - len(data))
+			else:
+				lines = list(f)
+		data.extendleft(reversed(lines))
+		if last and len(data) >= last:
+			break
+	return data
+
+def _log_path(request, google=False):
+	'''
+	The log of the crawler, or its google log: the log_path and
+	log_google_path of the crawler settings, repeated in the ini file
+	'''
+	settings = request.registry.settings
+	if google:
+		return settings.get('log_google_path', '/tmp/keygrabber-google.log')
+	return settings.get('log_path', '/tmp/keygrabber.log')
+
 @view_config(name='logs-google',context='webkeywords.resources.Root', renderer='webkeywords:templates/logs.pt')
 @view_config(name='logs',context='webkeywords.resources.Root', renderer='webkeywords:templates/logs.pt')
 def show_logs(request):
 	last = request.GET.get('last')
-	ufile = '/tmp/keygrabber.log'
-	if request.view_name == 'logs-google':
-		ufile = '/tmp/keygrabber-google.log'
-	if last:
-		data = deque(codecs.open(ufile, "r", "utf-8"), int(last))
-	else:
-		data = deque(codecs.open(ufile, "r", "utf-8"))
+	ufile = _log_path(request, request.view_name == 'logs-google')
+	data = _log_lines(ufile, int(last) if last else None)
 	'''
 	data = list()
 	
@@ -74,18 +109,114 @@ def show_logs(request):
 @view_config(name='logs-google-download', context='webkeywords.resources.Root')
 @view_config(name='logs-download', context='webkeywords.resources.Root')
 def download_logs(request):
-	last = request.GET.get('last')
-	ufile = '/tmp/keygrabber.log'
-	if request.view_name == 'logs-google-download':
-		ufile = '/tmp/keygrabber-google.log'
-	f = open(ufile)
-	return Response(content_type='text/plain', body=f.read())
+	ufile = _log_path(request, request.view_name == 'logs-google-download')
+	body = list()
+	for name in reversed(_log_files(ufile)):
+		with open(name) as f:
+			body.append(f.read())
+	return Response(content_type='text/plain', body=''.join(body))
+
+@view_config(name='stats', context='webkeywords.resources.Root', renderer='json', permission='view')
+def crawl_stats(context, request):
+	'''
+	Last metrics published by the crawler processes
+	'''
+	return dict(stats=list(request.db.crawler_stats.find().sort('_id')))
 
 def my_view(request):
 	c = InstantKeywordMongo()    
 	return search_keyword(c, request)
 
 items_per_page = 30
+#the orders of search_keyword, the sort of google adwords breaks its ties by _id
+SORTS = {'google instant': [('index', pymongo.ASCENDING)],
+	'google adwords': [('global_searches', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)]}
+#seconds the count of a search is reused, if orderedkeys is not published again
+count_ttl = 60
+_counts = dict()
+
+def _frozen(value):
+	'''
+	A hashable value equal for equal queries
+	'''
+	if hasattr(value, 'pattern'):
+		return ('re', value.pattern)
+	if isinstance(value, dict):
+		return tuple(sorted((k, _frozen(v)) for k, v in value.items()))
+	if isinstance(value, (list, tuple)):
+		return tuple(_frozen(v) for v in value)
+	return value
+
+def _count(request, spec):
+	'''
+	Keywords of orderedkeys matching spec, cached
+	'''
+	meta = request.db.published.find_one(dict(_id='orderedkeys'))
+	key = (_frozen(spec), meta.get('published') if meta else None)
+	now = time.time()
+	cached = _counts.get(key)
+	if cached is not None and now - cached[0] < count_ttl:
+		return cached[1]
+	count = request.db.orderedkeys.find(spec).count()
+	if len(_counts) > 1000:
+		_counts.clear()
+	_counts[key] = (now, count)
+	return count
+
+def _position(doc, sort):
+	'''
+	Where doc is in sort, as the after and before arguments carry it
+	'''
+	if sort == 'google instant':
+		return repr(float(doc.get('index')))
+	return '%s:%s' % (doc.get('global_searches'), doc.get('_id'))
+
+def _keyset(sort, position, forward):
+	'''
+	Query of the keywords after position in sort, before it if not forward
+	'''
+	if sort == 'google instant':
+		return {'index': {'$gt' if forward else '$lt': float(position)}}
+	searches, _id = position.split(':', 1)
+	_id = ObjectId(_id)
+	#descending, null is the lowest
+	if searches == 'None':
+		if forward:
+			return {'global_searches': None, '_id': {'$lt': _id}}
+		return {'$or': [{'global_searches': None, '_id': {'$gt': _id}}, {'global_searches': {'$ne': None}}]}
+	searches = int(searches)
+	op = '$lt' if forward else '$gt'
+	query = [{'global_searches': {op: searches}}, {'global_searches': searches, '_id': {op: _id}}]
+	if forward:
+		query.append({'global_searches': None})
+	return {'$or': query}
+
+def _page(collection, spec, fields, sort, rows, offset=0, total=0, after=None, before=None, skip=0):
+	'''
+	rows keywords of spec in sort: the ones following after or preceding
+	before, skipping skip of them, else the ones at offset of total, read
+	from the nearest end. The links of search_keyword carry after or
+	before with a small skip, so the pages they lead to cost the same
+	wherever they are. A page=N typed without them is read by offset and
+	skips up to half of total.
+	'''
+	order = SORTS[sort]
+	reverse = [(field, -direction) for field, direction in order]
+	if rows <= 0:
+		return []
+	if after is not None or before is not None:
+		keyset = _keyset(sort, after if after is not None else before, after is not None)
+		spec = {'$and': [spec, keyset]} if spec else keyset
+		if after is not None:
+			return list(collection.find(spec, fields).sort(order).skip(skip).limit(rows))
+		docs = list(collection.find(spec, fields).sort(reverse).skip(skip).limit(rows))
+	elif offset <= total - offset - rows:
+		return list(collection.find(spec, fields).sort(order).skip(offset).limit(rows))
+	else:
+		docs = list(collection.find(spec, fields).sort(reverse).skip(max(total - offset - rows, 0)).limit(rows))
+	docs.reverse()
+	return docs
+
 @view_config(context='webkeywords.resources.Root', renderer='webkeywords:templates/index.pt', permission='view')
 @view_config(name='scritti', context='webkeywords.resources.Root', renderer='webkeywords:templates/index.pt', permission='view')
 @view_config(name='bloccati', context='webkeywords.resources.Root', renderer='webkeywords:templates/index.pt', permission='view')
@@ -95,12 +226,15 @@ def search_keyword(context, request):
 	get_args_keyword = request.GET.copy()
 	if 'keyword' in get_args_keyword:
 		get_args_keyword.pop('keyword')
-	if 'page' in get_args_keyword:
-		get_args_keyword.pop('page')
+	for arg in ('page', 'after', 'before', 'skip'):
+		if arg in get_args_keyword:
+			get_args_keyword.pop(arg)
 	if 'category' in get_args_keyword:
 		get_args_keyword.pop('category')  
 
 	sort = request.GET.get('sort_by', 'google instant')	
+	if sort not in SORTS:
+		sort = 'google adwords'
 	fields = list(k_mongo.fields)
 	user = _get_user(request)	
 	for field in fields:
@@ -124,23 +258,23 @@ def search_keyword(context, request):
 			filt = {'$nor': [dict(keyword=v) for v in  user.scritti+user.bloccati]}
 		else:
 			filt = dict()
-	if sort == 'google instant':
-		inst_list = request.db.orderedkeys.find(dict(k_mongo.to_dict().items()+filt.items())).sort('index') if filt is not None else []
-	else:
-		inst_list = request.db.orderedkeys.find(dict(k_mongo.to_dict().items()+filt.items())).sort([('global_searches',pymongo.DESCENDING),]) if filt is not None else []
-	insts = [dict([(field, x.get(field)) for field in k_mongo.fields]) for x in inst_list]
+	spec = dict(k_mongo.to_dict().items()+filt.items()) if filt is not None else None
+	total = _count(request, spec) if spec is not None else 0
+	count = total
 	#crop keywords
-	email = authenticated_userid(request)
-	with Session.connect(request.registry.settings['db_name'] ) as s:
-		user = s.query(User).filter_by(email=email).one()
-		try:
-			if user.max_keys > 0:
-				insts = insts[:user.max_keys]
-		except AttributeError:
-			pass
-	count = len(insts)
-	cur_page = int(get_args.pop('page', 1))
-	insts = insts[(cur_page-1)*items_per_page:cur_page*items_per_page]
+	try:
+		if user.max_keys > 0:
+			count = min(count, user.max_keys)
+	except AttributeError:
+		pass
+	cur_page = max(int(get_args.pop('page', 1)), 1)
+	after = get_args.pop('after', None)
+	before = get_args.pop('before', None)
+	skip = max(0, min(int(get_args.pop('skip', 0)), 3 * items_per_page))
+	offset = (cur_page-1)*items_per_page
+	rows = min(items_per_page, count - offset)
+	inst_list = _page(request.db.orderedkeys, spec, list(k_mongo.fields) + ['index', 'global_searches'], sort, rows, offset, total, after, before, skip) if spec is not None else []
+	insts = [dict([(field, x.get(field)) for field in k_mongo.fields]) for x in inst_list]
 	pages = int(ceil(count / items_per_page)+1) 
 	more_pages = True if cur_page < pages else False
 	first_args = get_args.copy()
@@ -151,6 +285,10 @@ def search_keyword(context, request):
 	last_args['page'] = pages
 	end_args = get_args.copy()
 	end_args['page'] = max(cur_page + 1, 1)
+	if inst_list:
+		#the pages around this one follow from its first and last keyword
+		preview_args['before'] = _position(inst_list[0], sort)
+		end_args['after'] = _position(inst_list[-1], sort)
 	list_page_args = list()
 	if cur_page > 3:
 		start_page = cur_page -3
@@ -172,6 +310,12 @@ def search_keyword(context, request):
 	for i in range(start_page, end_page+1):
 		d = get_args.copy()
 		d['page'] = i
+		if inst_list and i < cur_page:
+			d['before'] = preview_args['before']
+			d['skip'] = (cur_page - i - 1) * items_per_page
+		elif inst_list and i > cur_page:
+			d['after'] = end_args['after']
+			d['skip'] = (i - cur_page - 1) * items_per_page
 		list_page_args.append(d)
 	
 	orientation = list()